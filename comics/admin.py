@@ -1,4 +1,5 @@
 import math
+import zipfile
 from decimal import Decimal
 
 from adminsortable2.admin import SortableInlineAdminMixin
@@ -10,23 +11,52 @@ from django.db import transaction
 from django.db.models import Window, F, Max
 from django.db.models.functions import RowNumber
 from django.forms import Textarea
+from django.views.decorators.csrf import csrf_exempt
 
 from comics.forms import NumeralField, InstallmentFileField
-from comics.importers import parse_pages, parse_pdf, get_pfr
+from comics.importers import parse_pages, get_pfr, count_cbz_pages
+from comics.jobs import enqueue_import
+from comics.search import search_entries, MODEL_KINDS
+from comics.uploadhandler import use_sniffing_handlers, ext_content_kind, CONTENT_KIND_LABELS
 from comics.util import is_model_request, get_ext_name
-from comics.validators import ARCHIVE_EXTS, IMAGE_EXTS
-from .models import Installment, Series, Thread, ThreadSequence, Page, InstallmentLabel
+from comics.validators import ARCHIVE_EXTS, CBZ_EXTS
+from .models import Installment, Series, Thread, ThreadSequence, Page, InstallmentLabel, ImportJob
 
 
 def is_series_request(request):
     return is_model_request(request, Series)
 
 
+class IndexedSearchMixin(object):
+    # NOTE: search_fields still has to be set for the search box to show up
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        entries = search_entries(search_term, kinds=[MODEL_KINDS[self.model]], limit=None)
+        return queryset.filter(pk__in=[e.object_id for e in entries]), False
+
+
+class SniffedUploadsMixin(object):
+    # NOTE: CsrfViewMiddleware reads the POST, after which the upload handlers
+    #       can't be changed; changeform_view still does the check itself
+    @csrf_exempt
+    def add_view(self, request, form_url='', extra_context=None):
+        use_sniffing_handlers(request)
+        return super().add_view(request, form_url, extra_context)
+
+    @csrf_exempt
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        use_sniffing_handlers(request)
+        return super().change_view(request, object_id, form_url, extra_context)
+
+
 #########################################
 # Installment Form                      #
 #########################################
 
 class InstallmentAdminForm(forms.ModelForm):
+    upload_page_count = 0
+
     page_files = InstallmentFileField(
         required=False,
         label='Upload file(s)',
@@ -71,12 +101,28 @@ class InstallmentAdminForm(forms.ModelForm):
             if len(page_files) > 1 and file_exts & set(ARCHIVE_EXTS):
                 raise ValidationError('Only one archive file at a time is accepted.')
 
+            # checked against what the upload handler saw, rather than by opening them
+            for f in page_files:
+                expected = ext_content_kind(get_ext_name(f))
+                if hasattr(f, 'content_kind') and f.content_kind != expected:
+                    self.add_error('page_files', ValidationError('{} is not {}.'.format(
+                        f.name, CONTENT_KIND_LABELS[expected])))
+            if self.has_error('page_files'):
+                return
+
             if 'pdf' in file_exts:
-                self.instance.page_count = get_pfr(page_files[0]).getNumPages()
-            elif 'zip' in file_exts:
-                raise ValidationError('Zip unpacking not implemented.')
+                self.upload_page_count = getattr(page_files[0], 'page_count', None) \
+                    or get_pfr(page_files[0]).getNumPages()
+            elif file_exts & CBZ_EXTS:
+                try:
+                    self.upload_page_count = count_cbz_pages(page_files[0])
+                except zipfile.BadZipFile:
+                    self.add_error('page_files', ValidationError('Not a valid CBZ / ZIP archive.'))
+                    return
+                if not self.upload_page_count:
+                    self.add_error('page_files', ValidationError('No page images found in archive.'))
             else:
-                self.instance.page_count = len(page_files)
+                self.upload_page_count = len(page_files)
 
 
 #########################################
@@ -128,7 +174,7 @@ class SeriesAdminForm(forms.ModelForm):
 
 
 @admin.register(Series)
-class SeriesAdmin(admin.ModelAdmin):
+class SeriesAdmin(SniffedUploadsMixin, IndexedSearchMixin, admin.ModelAdmin):
     search_fields = ('name',)
     form = SeriesAdminForm
     inlines = [InstallmentInline]
@@ -179,11 +225,28 @@ class SeriesAdmin(admin.ModelAdmin):
 # Installment Admin                     #
 #########################################
 
+class ImportJobInline(admin.TabularInline):
+    model = ImportJob
+    max_num = 0
+    extra = 0
+    can_delete = False
+
+    fields = (
+        'status',
+        'done_pages',
+        'total_pages',
+        'created_at',
+        'finished_at',
+    )
+    readonly_fields = fields
+
+
 @admin.register(Installment)
-class InstallmentAdmin(admin.ModelAdmin):
+class InstallmentAdmin(SniffedUploadsMixin, IndexedSearchMixin, admin.ModelAdmin):
     search_fields = ('series__name', 'series__slug', 'number', 'title')
     form = InstallmentAdminForm
     autocomplete_fields = ('series',)
+    inlines = [ImportJobInline]
 
     def get_changeform_initial_data(self, request):
         initial = super().get_changeform_initial_data(request)
@@ -204,27 +267,15 @@ class InstallmentAdmin(admin.ModelAdmin):
         page_files = request.FILES.getlist('page_files')
         if page_files:
             archive = page_files[0]
-            ext = get_ext_name(archive)
-            if ext not in ARCHIVE_EXTS:
+            if get_ext_name(archive) not in ARCHIVE_EXTS:
                 archive = None
 
             obj.archive = archive
-            obj.pages.all().delete()
             obj.save()
 
-            if ext in IMAGE_EXTS:
-                page_gen = parse_pages(page_files)
-            elif ext == 'pdf':
-                page_gen = parse_pdf(obj.archive)
-            else:
-                raise NotImplementedError('No CBZ / ZIP support yet.')
-
-            for i, file in page_gen:
-                obj.pages.create(
-                    order=i,
-                    file=file,
-                    original_name=file.name,
-                )
+            # the pages themselves are imported by the import_worker command
+            enqueue_import(obj, page_files, total_pages=form.upload_page_count)
+            self.message_user(request, 'Page import queued for "{}".'.format(obj))
         else:
             obj.save()
 
@@ -273,6 +324,22 @@ class InstallmentAdmin(admin.ModelAdmin):
         obj.save(update_fields=['ordinal'])
 
 
+#########################################
+# Import Job Admin                      #
+#########################################
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('installment', 'status', 'done_pages', 'total_pages', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    list_select_related = ('installment__series__installment_label',)
+    fields = list_display + ('started_at', 'error')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+
 #########################################
 # Thread Admin                          #
 #########################################
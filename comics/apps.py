@@ -1,5 +1,25 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    # NOTE: most of these only last as long as the connection, hence the
+    #       hook rather than a one-off; CONN_MAX_AGE keeps them around
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
 
 
 class ComicsConfig(AppConfig):
     name = 'comics'
+
+    def ready(self):
+        connection_created.connect(set_sqlite_pragmas, dispatch_uid='comics.set_sqlite_pragmas')
+        # spans both apps, so its signal handlers can only be hooked up once all are loaded
+        from comics import search
+        post_migrate.connect(search.search_migrated_handler, sender=self,
+                             dispatch_uid='comics.search_migrated_handler')
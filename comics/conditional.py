@@ -0,0 +1,150 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max, Count
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+
+RESPONSE_CACHE_PREFIX = 'response'
+CACHED_VIEWS = []
+
+
+def latest_stamp(queryset):
+    # the count catches deletions, which leave nothing behind to bump
+    stamp = queryset.aggregate(updated_at=Max('updated_at'), count=Count('pk'))
+    return stamp['updated_at'], stamp['count']
+
+
+#########################################
+# Response Cache                        #
+#########################################
+
+def get_response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def get_counter_key(name, outcome):
+    return '{}:{}:{}'.format(RESPONSE_CACHE_PREFIX, outcome, name)
+
+
+def count_response(name, outcome):
+    cache = get_response_cache()
+    key = get_counter_key(name, outcome)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted in between; not worth retrying for a counter
+        pass
+
+
+def get_response_stats():
+    cache = get_response_cache()
+    return [(name,
+             cache.get(get_counter_key(name, 'hits'), 0),
+             cache.get(get_counter_key(name, 'misses'), 0))
+            for name in CACHED_VIEWS]
+
+
+def reset_response_stats():
+    get_response_cache().delete_many([get_counter_key(name, outcome)
+                                      for name in CACHED_VIEWS
+                                      for outcome in ('hits', 'misses')])
+
+
+def cache_response(view_func):
+    name = view_func.__name__
+    CACHED_VIEWS.append(name)
+
+    @wraps(view_func)
+    def inner(request, *args, **kwargs):
+        # NOTE: the validators change whenever the signal handlers bump a
+        #       timestamp the page depends on, which invalidates the entry
+        etag = request.validators[0]
+        if etag is None:
+            return view_func(request, *args, **kwargs)
+
+        cache = get_response_cache()
+        digest = hashlib.md5((etag + request.get_full_path()).encode()).hexdigest()
+        key = '{}:{}:{}'.format(RESPONSE_CACHE_PREFIX, name, digest)
+
+        response = cache.get(key)
+        if response is not None:
+            count_response(name, 'hits')
+            response['X-Cache'] = 'HIT'
+            return response
+
+        count_response(name, 'misses')
+        response = view_func(request, *args, **kwargs)
+        response['X-Cache'] = 'MISS'
+        if response.status_code == 200:
+            def store(r):
+                # just the bytes and headers; DRF Responses also carry their data
+                stored = HttpResponse(r.content, status=r.status_code)
+                for header, value in r.items():
+                    stored[header] = value
+                cache.set(key, stored, settings.RESPONSE_CACHE_TIMEOUT)
+
+            # template responses only have content once rendered
+            if callable(getattr(response, 'render', None)):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+        return response
+
+    return inner
+
+
+#########################################
+# Conditional GET                       #
+#########################################
+
+def conditional_view(get_stamps, cache=False, strong=False):
+    """
+    Answer revisits with 304 Not Modified, using the few cheap queries made by
+    get_stamps(**url_kwargs) rather than the view's own. It returns a list of
+    latest_stamp()s, and any change to one of those changes the validators.
+    With cache=True, full responses are also kept in the response cache under
+    those same validators. With strong=True, the ETag is a strong one, for
+    views with a single representation that the stamps fully determine.
+    """
+    def get_validators(request, *args, **kwargs):
+        # condition() asks for each validator separately, so only query once
+        if not hasattr(request, 'validators'):
+            stamps = get_stamps(*args, **kwargs)
+            times = [t for t, _ in stamps if t is not None]
+            if times:
+                if strong:
+                    etag = '"{}"'.format(hashlib.md5(repr(stamps).encode()).hexdigest())
+                else:
+                    # the same URL is rendered as either HTML or JSON
+                    key = repr((stamps, request.META.get('HTTP_ACCEPT', '')))
+                    etag = 'W/"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+                request.validators = etag, max(times)
+            else:
+                # nothing there; let the view 404 as usual
+                request.validators = None, None
+        return request.validators
+
+    def get_etag(request, *args, **kwargs):
+        return get_validators(request, *args, **kwargs)[0]
+
+    def get_last_modified(request, *args, **kwargs):
+        return get_validators(request, *args, **kwargs)[1]
+
+    def decorator(view_func):
+        if cache:
+            view_func = cache_response(view_func)
+        conditional_func = condition(etag_func=get_etag, last_modified_func=get_last_modified)(view_func)
+
+        @wraps(view_func)
+        def inner(request, *args, **kwargs):
+            response = conditional_func(request, *args, **kwargs)
+            patch_vary_headers(response, ['Accept'])
+            return response
+        return inner
+
+    return decorator
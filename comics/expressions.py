@@ -31,10 +31,12 @@ class GroupConcat(Aggregate):
         )
 
     def as_postgresql(self, compiler, connection, **extra_context):
+        # string_agg has no default separator, and only takes text
         return self.as_sql(
             compiler, connection,
             function='string_agg',
-            separator=self.get_separator(", '%s'"),
+            template="%(function)s(%(distinct)s%(expressions)s::text, '%(separator)s')",
+            separator=self.extra['separator'],
             **extra_context
         )
 
@@ -4,7 +4,6 @@ from io import BytesIO
 from json import JSONDecodeError
 from pathlib import Path
 
-from PIL import Image
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.forms import FileInput, ImageField, RegexField, Widget, FileField, ClearableFileInput
@@ -90,6 +89,8 @@ class CroppieField(ImageField):
     # TODO: a validator for the returned crop box points
 
     def to_python(self, data):
+        from PIL import Image
+
         # let ImageField to its thing
         f = super().to_python(data)
         if f is None:
@@ -147,5 +148,5 @@ class NumeralField(RegexField):
 
 
 class InstallmentFileField(FileField):
-    widget = ClearableFileInput(attrs={'multiple': True, 'accept': 'image/*,.pdf,.zip'})
+    widget = ClearableFileInput(attrs={'multiple': True, 'accept': 'image/*,.pdf,.cbz,.zip'})
     default_validators = [validate_installment_extension]
@@ -0,0 +1,15 @@
+from imagekit import ImageSpec, register
+from imagekit.processors import ResizeToFit
+
+
+class Cover(ImageSpec):
+    format = 'JPEG'
+    options = {'quality': 85, 'progressive': True}
+
+    def __init__(self, width=None, height=None, **kwargs):
+        # fixed width, whatever the aspect ratio of the page
+        self.processors = [ResizeToFit(width, height, upscale=False)]
+        super().__init__(**kwargs)
+
+
+register.generator('comics:cover', Cover)
@@ -2,15 +2,27 @@ import io
 import math
 import mimetypes
 import re
+import zipfile
+from operator import attrgetter
 from os.path import getsize
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
-import PyPDF2
-import pyvips
-from PIL import Image as PilImage
+from django.conf import settings
+from django.core.files import File
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 
-from comics.util import get_upload_fp
+from comics.raster import local_pdf_path, rasterize_pages
+from comics.storage import MediaTemporaryFile
+from comics.util import get_upload_fp, get_ext_name
+from comics.validators import IMAGE_EXTS
+
+# NOTE: PyPDF2, pyvips and PIL are imported where used, as this module is
+#       pulled in by the admin, and so by every web worker at startup
+
+# NOTE: importers yield (index, file) pairs; where a page's pixel size is
+#       already known, it comes along as file.image_size so the page writer
+#       needn't read it back out of the image; and one already on local disk
+#       can be moved (temporary_file_path) or linked (local_path) into storage
 
 RE_NAME_SLICER = re.compile(r'^(?P<label>(?:[-_a-z\s]+(?:\d+[-_\s]+)?)?0*(?P<number>\d+)).*'
                             r'\.(?P<ext>[a-z1-9]+)$',
@@ -21,17 +33,18 @@ RE_NAME_SLICER = re.compile(r'^(?P<label>(?:[-_a-z\s]+(?:\d+[-_\s]+)?)?0*(?P<num
 # Image Files                           #
 #########################################
 
-def parse_pages(page_files):
+def sort_pages(page_files, get_name=attrgetter('name')):
     pages = []
 
     for f in page_files:
-        if re.search('cover', f.name):
+        name = get_name(f)
+        if re.search('cover', name):
             pages.append({
                 'number': 0,
                 'file': f,
             })
         else:
-            m = RE_NAME_SLICER.search(f.name)
+            m = RE_NAME_SLICER.search(name)
             if m:
                 number = int(m.group('number'))
 
@@ -49,8 +62,55 @@ def parse_pages(page_files):
 
     pages.sort(key=lambda pi: pi['number'])
 
-    for i, p in enumerate(pages):
-        yield i, p['file']
+    return [p['file'] for p in pages]
+
+
+def parse_pages(page_files):
+    yield from enumerate(sort_pages(page_files))
+
+
+#########################################
+# Archive Files                         #
+#########################################
+
+def open_archive(archive_file):
+    if hasattr(archive_file, 'temporary_file_path'):
+        return zipfile.ZipFile(archive_file.temporary_file_path())
+    elif hasattr(archive_file, 'read'):
+        archive_file.seek(0)
+        return zipfile.ZipFile(archive_file)
+    else:
+        raise NotImplementedError('Unsure how to access file.')
+
+
+def get_member_name(info):
+    return PurePosixPath(info.filename).name
+
+
+def list_archive_pages(zf):
+    # everything we need is in the central directory, so nothing gets inflated
+    members = [info for info in zf.infolist()
+               if not info.is_dir()
+               and not info.filename.startswith('__MACOSX/')
+               and not get_member_name(info).startswith('.')
+               and get_ext_name(info.filename) in IMAGE_EXTS]
+    return sort_pages(members, get_member_name)
+
+
+def count_cbz_pages(archive_file):
+    with open_archive(archive_file) as zf:
+        return len(list_archive_pages(zf))
+
+
+def parse_cbz(archive_file):
+    with open_archive(archive_file) as zf:
+        for i, info in enumerate(list_archive_pages(zf)):
+            # stream each member straight through to storage
+            with zf.open(info) as member:
+                file = File(member, name=get_member_name(info))
+                # don't let File go looking for the size by reading to the end
+                file.size = info.file_size
+                yield i, file
 
 
 #########################################
@@ -73,6 +133,8 @@ def page_name(pdf_name, i, ext):
 
 
 def get_pfr(pdf_file):
+    import PyPDF2
+
     # this is a non-trivial operation, and we can't close the tempfile anyway
     if not hasattr(pdf_file, 'pfr'):
         pdf_file.pfr = PyPDF2.PdfFileReader(get_upload_fp(pdf_file))
@@ -108,8 +170,32 @@ def get_page_info(pfr_page):
     }
 
 
+def convert_pdf(pdf_file, page_info, dpi=300, ext='.png', workers=None, **kwargs):
+    # each page is rendered on its own in a worker process, so memory use is
+    # bounded by the page rather than the whole document
+    pdf_name = file_stem(pdf_file)
+    content_type = mimetypes.guess_type('a'+ext)[0]
+    workers = workers or getattr(settings, 'PDF_RASTER_WORKERS', None)
+
+    def make_file(i):
+        # NOTE: next to the media, so the page writer can move it into place
+        return MediaTemporaryFile(page_name(pdf_name, i, ext), content_type, 0, None)
+
+    with local_pdf_path(pdf_file) as pdf_path:
+        for i, file, dims in rasterize_pages(pdf_path, len(page_info), make_file,
+                                             dpi=dpi,
+                                             workers=workers,
+                                             save_kwargs=kwargs):
+            file.size = getsize(file.temporary_file_path())
+            file.image_size = dims
+            yield i, file
+
+
 # https://stackoverflow.com/a/54449010
-def convert_pdf(pdf_file, page_info, dpi=300, ext='.png', **kwargs):
+# NOTE: superseded by convert_pdf; kept around as the benchmark baseline
+def convert_pdf_tall(pdf_file, page_info, dpi=300, ext='.png', **kwargs):
+    import pyvips
+
     # n is number of pages to load, -1 means load all pages
     if hasattr(pdf_file, 'temporary_file_path'):
         all_pages = pyvips.Image.new_from_file(pdf_file.temporary_file_path(),
@@ -153,11 +239,14 @@ def convert_pdf(pdf_file, page_info, dpi=300, ext='.png', **kwargs):
         with TemporaryUploadedFile(name, content_type, 0, None) as file:
             page.write_to_file(file.temporary_file_path(), **kwargs)
             file.size = getsize(file.temporary_file_path())
+            file.image_size = (width, height)
             yield i, file
 
 
 # https://stackoverflow.com/a/34116472
 def rip_pdf(pdf_file, pfr):
+    from PIL import Image as PilImage
+
     pdf_name = file_stem(pdf_file)
 
     # TODO: make use of /ColorSpace resources in Pillow if possible
@@ -197,7 +286,9 @@ def rip_pdf(pdf_file, pfr):
 
         name = page_name(pdf_name, i, ext)
         content_type = mimetypes.guess_type(name)[0]
-        yield i, InMemoryUploadedFile(buf, None, name, content_type, buf.tell(), None)
+        file = InMemoryUploadedFile(buf, None, name, content_type, buf.tell(), None)
+        file.image_size = size
+        yield i, file
 
 
 def parse_pdf(pdf_file):
@@ -0,0 +1,390 @@
+import os
+import traceback
+from collections import defaultdict, deque
+from functools import partial
+from operator import attrgetter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.images import get_image_dimensions
+from django.db import connection, transaction
+from django.db.models import F, Case, When, Value
+from django.utils import timezone
+
+from comics.importers import parse_pdf, parse_cbz, sort_pages
+from comics.models import ImportJob, Installment, Page, Series, SourceImage, PENDING, RUNNING, DONE, FAILED, touch
+from comics.storage import StagedFile, stage_file
+from comics.util import get_ext_name, file_sha256
+from comics.validators import ARCHIVE_EXTS, CBZ_EXTS
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_BULK_CHUNK = 200
+
+
+#########################################
+# Enqueueing                            #
+#########################################
+
+def enqueue_import(installment, page_files, total_pages=0):
+    job = ImportJob.objects.create(
+        installment=installment,
+        total_pages=total_pages,
+    )
+
+    # archives are already kept with the Installment, so only stage loose pages
+    if not installment.archive or get_ext_name(installment.archive) not in ARCHIVE_EXTS:
+        for f in page_files:
+            width, height = getattr(f, 'image_size', (None, None))
+            job.files.create(
+                file=f,
+                original_name=f.name,
+                sha256=getattr(f, 'sha256', ''),
+                image_width=width,
+                image_height=height,
+            )
+
+    return job
+
+
+#########################################
+# Processing                            #
+#########################################
+
+def claim_next_job():
+    for job in ImportJob.objects.filter(status=PENDING).order_by('created_at'):
+        # conditional update, so two workers can't both grab the same job
+        claimed = ImportJob.objects \
+            .filter(pk=job.pk, status=PENDING) \
+            .update(status=RUNNING, started_at=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def gen_job_pages(job):
+    archive = job.installment.archive
+    ext = get_ext_name(archive) if archive else None
+
+    if ext == 'pdf':
+        yield from parse_pdf(archive)
+    elif ext in CBZ_EXTS:
+        yield from parse_cbz(archive)
+    else:
+        staged = sort_pages(job.files.all(), attrgetter('original_name'))
+        for i, jf in enumerate(staged):
+            with jf.file.open('rb') as fp:
+                # wrap it up so the bytes get to the Page's own location
+                file = File(fp, name=jf.original_name)
+                if jf.sha256:
+                    file.sha256 = jf.sha256
+                if jf.image_width and jf.image_height:
+                    file.image_size = (jf.image_width, jf.image_height)
+                try:
+                    # linked rather than copied; the staged file goes with the job
+                    file.local_path = jf.file.path
+                except NotImplementedError:
+                    pass
+                yield i, file
+
+
+def read_page_size(file):
+    size = getattr(file, 'image_size', None)
+    if size is None:
+        # only parses as much of the header as needed, from the incoming file
+        size = get_image_dimensions(file)
+    if None in size:
+        raise ValueError('{}: unreadable image'.format(file.name))
+    return size
+
+
+class PageWriter(object):
+    """
+    Stages each page's file as it arrives, and inserts the rows in bulk: per
+    batch, the files are stored, then one multi-row INSERT into each of the
+    SourceImage and Page tables, then the counts and timestamps the page
+    signal handlers would have kept.
+    """
+    def __init__(self, job, batch_size=DEFAULT_BATCH_SIZE):
+        self.job = job
+        self.installment = job.installment
+        self.batch_size = batch_size
+        self.pages = []
+
+    def add(self, order, file):
+        self.pages.append(self.stage_page(order, file, getattr(file, 'sha256', None)))
+
+        # short transactions, so readers never wait long on the write lock
+        if len(self.pages) >= self.batch_size:
+            self.flush()
+
+    def stage_page(self, order, file, sha256):
+        width, height = read_page_size(file)
+        # NOTE: the importers reclaim each file once we move on, and nothing
+        #       goes into storage before its batch is written, so until then
+        #       it's kept with the temporary files, which a crash can't orphan
+        staged, staged_sha256 = stage_file(file)
+        page = Page(
+            installment=self.installment,
+            order=order,
+            original_name=file.name,
+            file_width=width,
+            file_height=height,
+            sha256=sha256 or staged_sha256 or '',
+        )
+        page._staged = staged
+        return page
+
+    @staticmethod
+    def store_pages(pages):
+        for page in pages:
+            # NOTE: straight to storage, as assigning to the ImageField (or
+            #       FieldFile.save) would open the stored file for its dimensions
+            field = page.file.field
+            with StagedFile(page.__dict__.pop('_staged'), page.original_name) as file:
+                if settings.CONTENT_ADDRESSED_PAGES:
+                    page.file.name, page.sha256, page._blob_pin = field.storage.save_blob(
+                        file, Path(file.name).suffix.lower(), page.sha256 or None)
+                else:
+                    page.sha256 = page.sha256 or file_sha256(file)
+                    name = field.generate_filename(page, file.name)
+                    page.file.name = field.storage.save(name, file, max_length=field.max_length)
+
+    def flush(self):
+        if not self.pages:
+            return
+        self.store_pages(self.pages)
+        with transaction.atomic():
+            self.insert_pages(self.pages)
+            self.update_installment(done_pages=F('done_pages') + len(self.pages))
+            transaction.on_commit(partial(release_pins, self.pages))
+        self.pages = []
+
+    def discard(self):
+        # files staged or stored for rows that never made it in
+        release_pins(self.pages)
+        for page in self.pages:
+            staged = page.__dict__.pop('_staged', None)
+            if staged:
+                os.remove(staged)
+            elif page.file:
+                page.file.storage.delete(page.file.name)
+        self.pages = []
+
+    def update_installment(self, **job_fields):
+        installment = Installment.objects.filter(pk=self.installment.pk)
+        installment.update_page_counts()
+        touch(installment)
+        touch(Series.objects.filter(installments=self.installment.pk))
+        ImportJob.objects.filter(pk=self.job.pk).update(**job_fields)
+
+    @staticmethod
+    def insert_pages(pages):
+        # bulk_create won't do multi-table inheritance, so fill the parent table
+        # first, and then the child table with the new keys
+        parents = [SourceImage(file=page.file.name,
+                               file_width=page.file_width,
+                               file_height=page.file_height,
+                               original_name=page.original_name,
+                               sha256=page.sha256)
+                   for page in pages]
+        SourceImage.objects.bulk_create(parents)
+
+        if any(parent.pk is None for parent in parents):
+            # NOTE: only PostgreSQL hands back the new keys; whichever rows
+            #       are the newest for each name are ours, in the same order
+            by_name = defaultdict(list)
+            for parent in parents:
+                by_name[parent.file.name].append(parent)
+            keys = defaultdict(list)
+            for name, pk in SourceImage.objects \
+                    .filter(sha256__in={parent.sha256 for parent in parents}, file__in=list(by_name)) \
+                    .order_by('pk') \
+                    .values_list('file', 'pk'):
+                keys[name].append(pk)
+            for name, group in by_name.items():
+                for parent, pk in zip(group, keys[name][-len(group):]):
+                    parent.pk = pk
+
+        for page, parent in zip(pages, parents):
+            page.pk = page.id = parent.pk
+            page._state.adding = False
+
+        fields = Page._meta.local_concrete_fields
+        batch_size = connection.ops.bulk_batch_size(fields, pages)
+        for i in range(0, len(pages), batch_size):
+            # what Model.save() does for one row, done for many
+            Page.objects._insert(pages[i:i + batch_size], fields=fields)
+
+
+class ReimportWriter(PageWriter):
+    """
+    Imports over an Installment's existing pages, keeping every one whose
+    content turns up again (its row, file and Appearances), only moving it
+    if pages were inserted or removed before it. As with a diff, new pages
+    take over the rows of old ones that went missing from the same spot,
+    in order; whatever is left over is then inserted or deleted.
+    """
+    def __init__(self, job, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(job, batch_size)
+        # old Pages that turned up again, and new unsaved ones, in new order
+        self.sequence = []
+        self.old_pages = list(self.installment.pages.all())
+        self.fill_hashes(self.old_pages)
+        self.unmatched = defaultdict(deque)
+        for page in self.old_pages:
+            self.unmatched[page.sha256].append(page)
+
+    @staticmethod
+    def fill_hashes(pages):
+        # pages from before hashes were kept are read back once
+        missing = [page for page in pages if not page.sha256]
+        for page in missing:
+            with page.file.open('rb') as fp:
+                page.sha256 = file_sha256(fp)
+        update_in_bulk(SourceImage, 'sha256', {page.pk: page.sha256 for page in missing})
+
+    def add(self, order, file):
+        sha256 = getattr(file, 'sha256', None) or file_sha256(file)
+        matches = self.unmatched.get(sha256)
+        if matches:
+            self.sequence.append(matches.popleft())
+        else:
+            page = self.stage_page(order, file, sha256)
+            self.pages.append(page)
+            self.sequence.append(page)
+
+        # NOTE: nothing can be written until every page has been seen, as any
+        #       of them might turn out to be one already there
+        if len(self.sequence) % self.batch_size == 0:
+            ImportJob.objects.filter(pk=self.job.pk).update(done_pages=len(self.sequence))
+
+    @staticmethod
+    def group_by_gap(pages, is_kept):
+        # keyed by the last kept page before them, None being the very start
+        gaps = defaultdict(list)
+        last = None
+        for page in pages:
+            if is_kept(page):
+                last = page.pk
+            else:
+                gaps[last].append(page)
+        return gaps
+
+    def flush(self):
+        # only once at the end, with the whole picture
+        kept = {page.pk for page in self.sequence if page.pk is not None}
+        old_gaps = self.group_by_gap(self.old_pages, lambda page: page.pk in kept)
+        new_gaps = self.group_by_gap(self.sequence, lambda page: page.pk is not None)
+
+        replaced, inserted, deleted = [], [], []
+        for gap in set(old_gaps) | set(new_gaps):
+            old, new = old_gaps.get(gap, []), new_gaps.get(gap, [])
+            replaced += zip(old, new)
+            inserted += new[len(old):]
+            deleted += old[len(new):]
+
+        moved = {page.pk: order for order, page in enumerate(self.sequence)
+                 if page.pk is not None and page.order != order}
+        for old, new in replaced:
+            if old.order != new.order:
+                moved[old.pk] = new.order
+
+        # NOTE: in batches, each in a transaction of its own, as PageWriter
+        #       does; the counts and done_pages only add up at the very end
+        self.write_batches(deleted, self.delete_pages)
+        self.write_batches(replaced, self.replace_pages)
+        self.write_batches(list(moved.items()), self.move_pages)
+        self.write_batches(inserted, self.insert_new_pages)
+        with transaction.atomic():
+            self.update_installment(done_pages=len(self.sequence))
+        self.pages = []
+
+    def write_batches(self, items, write):
+        for i in range(0, len(items), self.batch_size):
+            with transaction.atomic():
+                write(items[i:i + self.batch_size])
+
+    def pages_written(self, pages):
+        # in for good, so no longer for discard() to clean up after
+        release_pins(pages)
+        written = {id(page) for page in pages}
+        self.pages = [page for page in self.pages if id(page) not in written]
+
+    @staticmethod
+    def delete_pages(pages):
+        # signals and all, so Appearances go and django_cleanup gets the files
+        for page in Page.objects.filter(pk__in=[page.pk for page in pages]):
+            page.delete()
+
+    def replace_pages(self, replaced):
+        new_pages = [new for _, new in replaced]
+        self.store_pages(new_pages)
+        for old, new in replaced:
+            SourceImage.objects \
+                .filter(pk=old.pk) \
+                .update(file=new.file.name,
+                        file_width=new.file_width,
+                        file_height=new.file_height,
+                        original_name=new.original_name,
+                        sha256=new.sha256)
+            # the row stays, so clean up after it by hand
+            transaction.on_commit(partial(old.file.storage.delete, old.file.name))
+        # NOTE: the page manifest goes by these, as it does the moved pages'
+        touch(Page.objects.filter(pk__in=[old.pk for old, _ in replaced]))
+        transaction.on_commit(partial(self.pages_written, new_pages))
+
+    @staticmethod
+    def move_pages(moved):
+        update_in_bulk(Page, 'order', dict(moved))
+        touch(Page.objects.filter(pk__in=[pk for pk, _ in moved]))
+
+    def insert_new_pages(self, pages):
+        self.store_pages(pages)
+        self.insert_pages(pages)
+        transaction.on_commit(partial(self.pages_written, pages))
+
+
+def release_pins(pages):
+    # see MediaStorage.save_blob; only content-addressed pages have them
+    for page in pages:
+        pin = page.__dict__.pop('_blob_pin', None)
+        if pin:
+            page.file.storage.release_blob(page.file.name, pin)
+
+
+def update_in_bulk(model, field, values):
+    # NOTE: no bulk_update() until Django 2.2; one CASE per chunk instead
+    keys = list(values)
+    for i in range(0, len(keys), DEFAULT_BULK_CHUNK):
+        chunk = keys[i:i + DEFAULT_BULK_CHUNK]
+        model.objects \
+            .filter(pk__in=chunk) \
+            .update(**{field: Case(*[When(pk=pk, then=Value(values[pk])) for pk in chunk],
+                                   output_field=model._meta.get_field(field))})
+
+
+def run_import_job(job, batch_size=DEFAULT_BATCH_SIZE):
+    installment = job.installment
+    try:
+        writer_class = ReimportWriter if installment.pages.exists() else PageWriter
+        writer = writer_class(job, batch_size=batch_size)
+        try:
+            for i, file in gen_job_pages(job):
+                writer.add(i, file)
+            writer.flush()
+        except Exception:
+            writer.discard()
+            raise
+    except Exception:
+        job.status = FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = DONE
+        job.files.all().delete()
+
+    job.refresh_from_db(fields=['done_pages'])
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
@@ -0,0 +1,118 @@
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+
+from comics.models import Series, Installment, Page
+from metadata.models import Character, Persona, Appearance, Creator, Credit, Role
+
+CATALOG_PREFIX = 'catalog-benchmark'
+
+
+class Command(BaseCommand):
+    help = 'Build a synthetic catalog and measure how many requests/s the main views serve from it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', type=int, default=10)
+        parser.add_argument('--installments', type=int, default=5,
+                            help='Installments per Series.')
+        parser.add_argument('--pages', type=int, default=20,
+                            help='Pages per Installment.')
+        parser.add_argument('--characters', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Requests made to each view.')
+        parser.add_argument('--keep', action='store_true',
+                            help='Leave the catalog in place afterwards.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{} ({})'.format(connection.vendor, settings.DATABASES['default']['NAME']))
+
+        start = time.perf_counter()
+        series, character, creator = self.build_catalog(options)
+        self.stdout.write('catalog built in {:.2f}s'.format(time.perf_counter() - start))
+
+        try:
+            installment = series.installments.first()
+            urls = [
+                ('index', reverse('comics:index'), {}),
+                ('series', series.get_absolute_url(), {}),
+                ('installment', installment.get_absolute_url(), {}),
+                ('installment json', installment.get_absolute_url(), {'HTTP_ACCEPT': 'application/json'}),
+                ('characters', reverse('metadata:index'), {}),
+                ('character', character.get_absolute_url(), {}),
+                ('creators', reverse('metadata:creators'), {}),
+                ('creator', creator.get_absolute_url(), {}),
+            ]
+
+            client = Client()
+            for label, url, extra in urls:
+                elapsed = 0
+                for _ in range(options['requests']):
+                    # NOTE: only the database is being measured here, so
+                    #       nothing may come out of the response cache
+                    for cache in caches.all():
+                        cache.clear()
+                    start = time.perf_counter()
+                    response = client.get(url, **extra)
+                    elapsed += time.perf_counter() - start
+                    if response.status_code != 200:
+                        self.stderr.write('{}: {} {}'.format(label, url, response.status_code))
+                        break
+                self.stdout.write('{:>16}: {:8.1f} req/s  {:7.2f} ms/req'.format(
+                    label, options['requests'] / elapsed, elapsed / options['requests'] * 1000))
+        finally:
+            if not options['keep']:
+                Series.objects.filter(slug__startswith=CATALOG_PREFIX).delete()
+                Character.objects.filter(personas__name__startswith=CATALOG_PREFIX).delete()
+                Creator.objects.filter(working_name__startswith=CATALOG_PREFIX).delete()
+
+    @staticmethod
+    @transaction.atomic
+    def build_catalog(options):
+        # NOTE: every Page shares the one file, which the cover thumbnails need
+        from PIL import Image
+
+        buf = BytesIO()
+        Image.new('RGB', (800, 1200)).save(buf, 'PNG')
+        page_file = default_storage.save('catalog/page.png', ContentFile(buf.getvalue()))
+
+        creator = Creator.objects.create(working_name='{} creator'.format(CATALOG_PREFIX))
+        role = Role.objects.first()
+
+        personas = []
+        for c in range(options['characters']):
+            character = Character.objects.create()
+            persona = Persona.objects.create(character=character, name='{} {}'.format(CATALOG_PREFIX, c))
+            character.primary_persona = persona
+            character.save()
+            personas.append(persona)
+
+        all_series = []
+        for s in range(options['series']):
+            series = Series.objects.create(name='{} {}'.format(CATALOG_PREFIX, s),
+                                           slug='{}-{}'.format(CATALOG_PREFIX, s))
+            all_series.append(series)
+            for n in range(1, options['installments'] + 1):
+                installment = Installment.objects.create(series=series, number=n, ordinal=n)
+                if role is not None:
+                    Credit.objects.create(installment=installment, creator=creator, role=role)
+                pages = [Page.objects.create(installment=installment,
+                                             order=o,
+                                             file=page_file,
+                                             file_width=800,
+                                             file_height=1200)
+                         for o in range(options['pages'])]
+                appearances = [Appearance(persona=personas[(s + n + o) % len(personas)],
+                                          installment=installment,
+                                          page=page)
+                               for o, page in enumerate(pages)]
+                Appearance.objects.bulk_create(appearances)
+
+        return all_series[0], personas[0].character, creator
@@ -0,0 +1,57 @@
+import time
+from io import BytesIO
+from unittest import mock
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from comics.jobs import enqueue_import, run_import_job, DEFAULT_BATCH_SIZE
+from comics.models import Series, Installment
+
+
+def make_png(size):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new('RGB', size).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Time a generated import through the job pipeline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=400,
+                            help='Pages in the generated import.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Pages committed per transaction.')
+        parser.add_argument('--keep', action='store_true',
+                            help='Leave the generated Series in place afterwards.')
+
+    def handle(self, *args, **options):
+        series = Series.objects.create(name='Import Benchmark', slug='import-benchmark-{}'.format(time.time_ns()))
+        try:
+            installment = Installment.objects.create(series=series, number=1, ordinal=1)
+            png = make_png((800, 1200))
+            files = [SimpleUploadedFile('{:04d}.png'.format(i), png, 'image/png')
+                     for i in range(options['pages'])]
+            job = enqueue_import(installment, files, total_pages=len(files))
+
+            # NOTE: only what the import itself opens from storage, not the staged files
+            opens = mock.patch.object(FileSystemStorage, 'open', autospec=True, side_effect=FileSystemStorage.open)
+            with CaptureQueriesContext(connection) as queries, opens as opened:
+                start = time.perf_counter()
+                run_import_job(job, batch_size=options['batch_size'])
+                elapsed = time.perf_counter() - start
+
+            if job.error:
+                self.stderr.write(job.error)
+            self.stdout.write('{} pages in {:.2f}s ({:.1f} pages/s), {} queries, {} storage opens'.format(
+                job.done_pages, elapsed, job.done_pages / elapsed if elapsed else 0,
+                len(queries), opened.call_count - len(files)))
+        finally:
+            if not options['keep']:
+                series.delete()
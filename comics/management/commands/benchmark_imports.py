@@ -0,0 +1,71 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# roughly what a web worker goes through before it serves its first page
+WORKER_STARTUP = '; '.join([
+    'import django',
+    'django.setup()',
+    'from django.urls import get_resolver',
+    'get_resolver().url_patterns',
+    'from django.template import engines',
+    'engines.all()',
+])
+
+# only ever needed by the import paths, or first loaded where used
+LAZY_MODULES = ('pyvips', 'PyPDF2', 'inflect', 'tldextract')
+
+RE_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_import_times(output):
+    for line in output.splitlines():
+        m = RE_IMPORT_TIME.match(line)
+        if m:
+            cumulative, indent, name = int(m.group(2)), m.group(3), m.group(4)
+            yield name, len(indent) // 2, cumulative
+
+
+class Command(BaseCommand):
+    help = 'Time the imports of a starting web worker, using python -X importtime.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of slowest top-level imports to list.')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if any of the lazily loaded libraries were imported.')
+        parser.add_argument('--max-ms', type=float, default=None,
+                            help='Fail if all imports together take longer than this.')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', WORKER_STARTUP],
+                                cwd=settings.BASE_DIR,
+                                env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        if result.returncode:
+            raise CommandError(result.stderr.splitlines()[-1])
+
+        times = list(parse_import_times(result.stderr))
+        top_level = sorted(((us, name) for name, depth, us in times if depth == 0), reverse=True)
+        total_ms = sum(us for us, _ in top_level) / 1000
+
+        self.stdout.write('total: {:8.1f} ms'.format(total_ms))
+        for us, name in top_level[:options['top']]:
+            self.stdout.write('{:>15.1f} ms  {}'.format(us / 1000, name))
+
+        imported = {name for name, _, _ in times}
+        eager = [name for name in LAZY_MODULES if name in imported]
+        self.stdout.write('eagerly imported: {}'.format(', '.join(eager) or 'none'))
+
+        if options['check'] and eager:
+            raise CommandError('Imported at startup: {}'.format(', '.join(eager)))
+        if options['max_ms'] is not None and total_ms > options['max_ms']:
+            raise CommandError('Imports took {:.1f} ms, over the {:.1f} ms budget'.format(
+                total_ms, options['max_ms']))
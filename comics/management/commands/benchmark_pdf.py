@@ -0,0 +1,52 @@
+import resource
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from comics.importers import get_pfr, get_page_info, convert_pdf, convert_pdf_tall
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Compare per-page PDF rasterization against the single tall-image path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf', help='Path to a PDF to rasterize.')
+        parser.add_argument('--dpi', type=int, default=150)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes for the per-page engine.')
+        parser.add_argument('--skip-tall', action='store_true',
+                            help='Only time the per-page engine.')
+
+    def handle(self, *args, **options):
+        try:
+            pdf_file = File(open(options['pdf'], 'rb'))
+        except OSError as e:
+            raise CommandError(e)
+
+        with pdf_file:
+            page_info = [get_page_info(page) for page in get_pfr(pdf_file).pages]
+            self.stdout.write('{} pages at {} dpi'.format(len(page_info), options['dpi']))
+
+            runs = [('per-page', convert_pdf, {'workers': options['workers']})]
+            if not options['skip_tall']:
+                runs.insert(0, ('tall', convert_pdf_tall, {}))
+
+            for label, func, extra in runs:
+                start = time.perf_counter()
+                count = 0
+                for _, _ in func(pdf_file, page_info, options['dpi'], ext='.jpg', Q=95, **extra):
+                    count += 1
+                elapsed = time.perf_counter() - start
+
+                self.stdout.write('{:>8}: {:7.2f}s  {:6.2f} pages/s'.format(
+                    label, elapsed, count / elapsed if elapsed else 0))
+
+        # NOTE: peak RSS is cumulative, so run the engines separately to compare memory
+        self.stdout.write('peak RSS: {:.1f} MB (main), {:.1f} MB (largest worker)'.format(
+            peak_rss_mb(resource.RUSAGE_SELF), peak_rss_mb(resource.RUSAGE_CHILDREN)))
@@ -0,0 +1,125 @@
+import multiprocessing
+import statistics
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, OperationalError
+
+from comics.jobs import enqueue_import, run_import_job, DEFAULT_BATCH_SIZE
+from comics.models import Series, Installment
+from comics.views import gen_page_manifest
+
+SQLITE_REPORTED = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout')
+
+
+def make_png(size):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new('RGB', size).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def read_until(installment, stop, results):
+    times = []
+    errors = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            # about what the index and an installment's reader ask for
+            list(Series.objects.with_cover())
+            gen_page_manifest(installment)
+        except OperationalError:
+            # 'database is locked', once busy_timeout runs out
+            errors += 1
+        else:
+            times.append(time.perf_counter() - start)
+    results.put((times, errors))
+
+
+class Command(BaseCommand):
+    help = 'Measure read throughput and latency while an import is writing pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=200,
+                            help='Pages in the generated import.')
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Concurrent reader processes.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Pages committed per transaction by the import.')
+        parser.add_argument('--keep', action='store_true',
+                            help='Leave the generated Series in place afterwards.')
+
+    def handle(self, *args, **options):
+        db = settings.DATABASES['default']
+        self.stdout.write('{} (CONN_MAX_AGE={})'.format(db['ENGINE'], db.get('CONN_MAX_AGE', 0)))
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                for name in SQLITE_REPORTED:
+                    cursor.execute('PRAGMA {}'.format(name))
+                    self.stdout.write('  {} = {}'.format(name, cursor.fetchone()[0]))
+
+        series = Series.objects.create(name='Read Benchmark', slug='read-benchmark-{}'.format(time.time_ns()))
+        try:
+            installment = Installment.objects.create(series=series, number=1, ordinal=1)
+            png = make_png((800, 1200))
+            files = [SimpleUploadedFile('{:04d}.png'.format(i), png, 'image/png')
+                     for i in range(options['pages'])]
+            job = enqueue_import(installment, files, total_pages=len(files))
+
+            def import_pages():
+                start = time.perf_counter()
+                run_import_job(job, batch_size=options['batch_size'])
+                return time.perf_counter() - start
+
+            elapsed = self.run_readers('during import', installment, options['readers'], import_pages)
+            if job.error:
+                self.stderr.write(job.error)
+            self.stdout.write('import: {} pages in {:.2f}s ({:.1f} pages/s)'.format(
+                job.done_pages, elapsed, job.done_pages / elapsed if elapsed else 0))
+
+            # the same again with nothing writing, for comparison
+            self.run_readers('idle', installment, options['readers'], lambda: time.sleep(elapsed))
+        finally:
+            if not options['keep']:
+                series.delete()
+
+    def run_readers(self, label, installment, count, work):
+        # NOTE: processes rather than threads, so readers and writer actually
+        #       run at the same time; forked children can't share connections
+        ctx = multiprocessing.get_context('fork')
+        stop = ctx.Event()
+        results = ctx.Queue()
+        readers = [ctx.Process(target=read_until, args=(installment, stop, results))
+                   for _ in range(count)]
+        connections.close_all()
+        for reader in readers:
+            reader.start()
+
+        start = time.perf_counter()
+        result = work()
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        times = []
+        errors = 0
+        for _ in readers:
+            reader_times, reader_errors = results.get()
+            times += reader_times
+            errors += reader_errors
+        for reader in readers:
+            reader.join()
+        times.sort()
+        if times:
+            self.stdout.write('{:>14}: {:6d} reads  {:8.1f} reads/s  '
+                              'p50 {:6.1f} ms  p99 {:7.1f} ms  max {:7.1f} ms  {} error(s)'.format(
+                                  label, len(times), len(times) / elapsed,
+                                  statistics.median(times) * 1000,
+                                  times[int(len(times) * 0.99)] * 1000,
+                                  times[-1] * 1000, errors))
+        else:
+            self.stdout.write('{:>14}: no reads completed, {} error(s)'.format(label, errors))
+        return result
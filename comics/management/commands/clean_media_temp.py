@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from comics.storage import clean_temp_dir
+
+
+class Command(BaseCommand):
+    help = 'Remove the temporary files left behind in MEDIA_TEMP_DIR, e.g. by interrupted uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24,
+                            help='Only remove files untouched for this long.')
+
+    def handle(self, *args, **options):
+        removed = clean_temp_dir(options['hours'] * 60 * 60)
+        if options['verbosity'] > 1:
+            for path in removed:
+                self.stdout.write(path)
+        self.stdout.write('{}: removed {} stale file(s).'.format(settings.MEDIA_TEMP_DIR, len(removed)))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.backends.jinja2 import Jinja2
+
+
+def load_all(env, names):
+    start = time.perf_counter()
+    for name in names:
+        env.get_template(name)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Precompile every Jinja2 template into the bytecode cache, e.g. at build time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', action='store_true',
+                            help='Also time a cold start without, and then with, the bytecode cache.')
+
+    def handle(self, *args, **options):
+        env = next((e.env for e in engines.all() if isinstance(e, Jinja2)), None)
+        if env is None or env.bytecode_cache is None:
+            raise CommandError('No Jinja2 bytecode cache configured; see JINJA2_BYTECODE_CACHE_DIR.')
+
+        names = env.list_templates()
+
+        # overlays get their own template cache, so each pass starts out cold
+        if options['benchmark']:
+            cold = load_all(env.overlay(cache_size=len(names), bytecode_cache=None), names)
+
+        env.bytecode_cache.clear()
+        load_all(env.overlay(cache_size=len(names)), names)
+        self.stdout.write('Compiled {} template(s).'.format(len(names)))
+
+        if options['benchmark']:
+            warm = load_all(env.overlay(cache_size=len(names)), names)
+            self.stdout.write('from source: {:7.1f} ms'.format(cold * 1000))
+            self.stdout.write('from cache:  {:7.1f} ms'.format(warm * 1000))
@@ -0,0 +1,79 @@
+import hashlib
+import os
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from comics.storage import BLOB_DIR, count_references, is_blob_name
+
+READ_CHUNK = 1024 * 1024
+
+
+def hash_path(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Report how much of the media tree is duplicated content, and what the shared blobs already save.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10,
+                            help='List this many of the most duplicated files.')
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+            for filename in filenames:
+                name = filename if rel_dir == '.' else '{}/{}'.format(rel_dir, filename)
+                entries.append((name, os.stat(os.path.join(dirpath, filename))))
+
+        sizes = defaultdict(list)
+        blobs = {}
+        inodes = set()
+        # blobs first, so that whatever is linked to one counts as the blob
+        for name, stat in sorted(entries, key=lambda entry: not is_blob_name(entry[0])):
+            # hard links to one file take up its space the once
+            if (stat.st_dev, stat.st_ino) in inodes:
+                continue
+            inodes.add((stat.st_dev, stat.st_ino))
+            if is_blob_name(name):
+                blobs[name] = stat.st_size
+            else:
+                sizes[stat.st_size].append(name)
+
+        # NOTE: only files sharing a size with another can be the same, so only those get read
+        by_hash = defaultdict(list)
+        for size, names in sizes.items():
+            if len(names) > 1:
+                for name in names:
+                    by_hash[(size, hash_path(os.path.join(root, name)))].append(name)
+
+        files = sum(len(names) for names in sizes.values())
+        total = sum(size * len(names) for size, names in sizes.items())
+        duplicates = sorted(((size, names) for (size, _), names in by_hash.items() if len(names) > 1),
+                            key=lambda dup: dup[0] * (len(dup[1]) - 1), reverse=True)
+        redundant = sum(size * (len(names) - 1) for size, names in duplicates)
+
+        self.stdout.write('{}: {} file(s), {} outside {}/'.format(root, files, filesizeformat(total), BLOB_DIR))
+        self.stdout.write('  {} duplicated content(s), {} ({:.1f}%) would be saved storing each once'.format(
+            len(duplicates), filesizeformat(redundant), redundant / total * 100 if total else 0))
+        for size, names in duplicates[:options['top']]:
+            self.stdout.write('  {} x {}: {}'.format(len(names), filesizeformat(size), ', '.join(names)))
+
+        refs = count_references(blobs)
+        shared = sum(size * (refs[name] - 1) for name, size in blobs.items() if name in refs)
+        orphans = [name for name in blobs if name not in refs]
+        self.stdout.write('{}/: {} blob(s), {}, referenced {} time(s); {} saved by sharing'.format(
+            BLOB_DIR, len(blobs), filesizeformat(sum(blobs.values())), sum(refs.values()),
+            filesizeformat(shared)))
+        if orphans:
+            self.stdout.write('  {} unreferenced blob(s), {}'.format(
+                len(orphans), filesizeformat(sum(blobs[name] for name in orphans))))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from comics.models import Page
+from comics.templatetags.image_extras import covergen, cover_widths
+
+
+class Command(BaseCommand):
+    help = 'Pre-generate the cover renditions used by the series and index grids.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', action='append', default=[],
+                            help='Limit to the given Series id(s).')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate renditions that already exist.')
+
+    def handle(self, *args, **options):
+        covers = Page.objects \
+            .filter(order=0, installment__has_cover=True) \
+            .only('file', 'file_width', 'file_height') \
+            .order_by('installment__series', 'installment__ordinal')
+        if options['series']:
+            covers = covers.filter(installment__series__in=options['series'])
+
+        generated = failed = 0
+        for cover in covers.iterator():
+            for width in cover_widths(cover):
+                try:
+                    covergen(cover, width).generate(force=options['force'])
+                    generated += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write('{} @ {}px: {}'.format(cover.file.name, width, e))
+
+        self.stdout.write('{} rendition(s) ready, {} failed.'.format(generated, failed))
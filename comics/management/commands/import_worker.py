@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from comics.jobs import claim_next_job, run_import_job, DEFAULT_BATCH_SIZE
+from comics.models import ImportJob, PENDING, RUNNING
+
+
+class Command(BaseCommand):
+    help = 'Process queued Installment imports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling.')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait between polls of an empty queue.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Pages committed per transaction.')
+        parser.add_argument('--requeue', action='store_true',
+                            help='Reset jobs left running by a dead worker before starting.')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            n = ImportJob.objects.filter(status=RUNNING).update(status=PENDING, done_pages=0)
+            self.stdout.write('Requeued {} job(s).'.format(n))
+
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write('Importing {} ...'.format(job.installment))
+            run_import_job(job, batch_size=options['batch_size'])
+            if job.error:
+                self.stderr.write(job.error)
+            self.stdout.write('{} ({}/{} pages)'.format(job, job.done_pages, job.total_pages))
@@ -0,0 +1,96 @@
+from django.core.files.images import get_image_dimensions
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from comics.models import SourceImage, GenericImage, Page, touch
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Backfill or verify the stored width / height columns of image files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Report mismatched dimensions without writing anything.')
+        parser.add_argument('--all', action='store_true',
+                            help='Check every file, not just those missing dimensions.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Rows updated per transaction.')
+
+    def handle(self, *args, **options):
+        targets = (
+            (SourceImage, 'file', 'file_width', 'file_height'),
+            (GenericImage, 'scaled', 'scaled_width', 'scaled_height'),
+        )
+
+        bad_total = 0
+        for model, file_field, width_field, height_field in targets:
+            # NOTE: plain values, as loading instances with empty dimension columns
+            #       would have ImageField fill them in by opening every file
+            storage = model._meta.get_field(file_field).storage
+            qs = model.objects \
+                .order_by('pk') \
+                .values_list('pk', file_field, width_field, height_field)
+            if not (options['all'] or options['verify']):
+                qs = qs.filter(Q(**{width_field: 0}) | Q(**{height_field: 0}))
+
+            checked = 0
+            mismatched = []
+            last_pk = None
+            while True:
+                # page through by key, so the rows being fixed can't shift the window
+                chunk = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+                chunk = list(chunk[:options['batch_size']])
+                if not chunk:
+                    break
+                last_pk = chunk[-1][0]
+
+                stale = []
+                for pk, name, width, height in chunk:
+                    size = self.read_size(storage, name)
+                    if size is None:
+                        bad_total += 1
+                    elif size != (width, height):
+                        stale.append((pk, size))
+                checked += len(chunk)
+
+                if options['verify']:
+                    mismatched += stale
+                else:
+                    self.write_sizes(model, width_field, height_field, stale)
+
+            for pk, size in mismatched:
+                self.stdout.write('{} {}: stored size differs from file {}'.format(
+                    model.__name__, pk, size))
+            bad_total += len(mismatched)
+
+            self.stdout.write('{}: checked {} file(s).'.format(model.__name__, checked))
+
+        if options['verify'] and bad_total:
+            raise CommandError('{} file(s) with missing or mismatched dimensions.'.format(bad_total))
+
+    def read_size(self, storage, name):
+        try:
+            with storage.open(name, 'rb') as file:
+                # only parses as much of the header as needed
+                size = get_image_dimensions(file)
+        except (OSError, ValueError) as e:
+            self.stderr.write('{}: {}'.format(name, e))
+            return None
+        if size == (None, None):
+            self.stderr.write('{}: unreadable image'.format(name))
+            return None
+        return size
+
+    @staticmethod
+    def write_sizes(model, width_field, height_field, sizes):
+        with transaction.atomic():
+            for pk, (width, height) in sizes:
+                model.objects \
+                    .filter(pk=pk) \
+                    .update(**{width_field: width, height_field: height})
+            if model is SourceImage:
+                # the page manifest is validated by its pages' updated_at
+                touch(Page.objects.filter(pk__in=[pk for pk, _ in sizes]))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from comics.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Re-create the full-text search index from scratch.'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write('Indexed {} object(s).'.format(count))
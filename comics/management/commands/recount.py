@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from comics.models import Installment, Series
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized page and installment counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Report stale counts without fixing them.')
+
+    def handle(self, *args, **options):
+        stale_installments = Installment.objects \
+            .annotate(actual=Installment.page_count_sq()) \
+            .exclude(page_count=F('actual'))
+        stale_series = Series.objects \
+            .annotate(actual=Series.installment_count_sq()) \
+            .exclude(installment_count=F('actual'))
+
+        if options['verify']:
+            stale = 0
+            for qs, field in ((stale_installments, 'page_count'), (stale_series, 'installment_count')):
+                for obj in qs:
+                    stale += 1
+                    self.stdout.write('{}: {} is {}, should be {}'.format(
+                        obj, field, getattr(obj, field), obj.actual))
+            if stale:
+                raise CommandError('{} stale count(s).'.format(stale))
+            return
+
+        with transaction.atomic():
+            n_installments = Installment.objects.update_page_counts()
+            n_series = Series.objects.update_installment_counts()
+        self.stdout.write('Recounted {} installment(s) and {} series.'.format(n_installments, n_series))
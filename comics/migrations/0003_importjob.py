@@ -0,0 +1,44 @@
+# Generated by Django 2.1.15 on 2026-10-18 12:48
+
+import comics.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comics', '0002_load_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1)),
+                ('total_pages', models.PositiveSmallIntegerField(default=0)),
+                ('done_pages', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('installment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='comics.Installment')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportJobFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to=comics.models.gen_job_loc)),
+                ('original_name', models.CharField(max_length=260)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='comics.ImportJob')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.1.15 on 2026-10-18 12:53
+
+from django.db import migrations, models
+from django.db.models import OuterRef
+
+from comics.expressions import SQCount
+
+
+#########################################
+# Counts                                #
+#########################################
+
+def populate_counts(apps, schema_editor):
+    series = apps.get_model('comics', 'Series')
+    installment = apps.get_model('comics', 'Installment')
+    page = apps.get_model('comics', 'Page')
+
+    installment.objects.update(page_count=SQCount(page.objects
+                                                  .order_by()
+                                                  .filter(installment=OuterRef('pk'))
+                                                  .values('pk')))
+    series.objects.update(installment_count=SQCount(installment.objects
+                                                    .order_by()
+                                                    .filter(series=OuterRef('pk'))
+                                                    .values('pk')))
+
+
+#########################################
+# Migration                             #
+#########################################
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comics', '0003_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='installment',
+            name='page_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Denormalized; maintained by signal handlers.'),
+        ),
+        migrations.AddField(
+            model_name='series',
+            name='installment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Denormalized; maintained by signal handlers.'),
+        ),
+        migrations.RunPython(
+            populate_counts,
+            migrations.RunPython.noop,
+        ),
+    ]
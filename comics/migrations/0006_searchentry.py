@@ -0,0 +1,83 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+# NOTE: external content, so the text is only stored once; the triggers keep
+#       the index in step with every write to comics_searchentry
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE comics_searchentry_fts
+    USING fts5(title, body, content='comics_searchentry', content_rowid='id', tokenize='porter unicode61')
+    """,
+    """
+    CREATE TRIGGER comics_searchentry_ai AFTER INSERT ON comics_searchentry BEGIN
+        INSERT INTO comics_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER comics_searchentry_ad AFTER DELETE ON comics_searchentry BEGIN
+        INSERT INTO comics_searchentry_fts(comics_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER comics_searchentry_au AFTER UPDATE ON comics_searchentry BEGIN
+        INSERT INTO comics_searchentry_fts(comics_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO comics_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER comics_searchentry_au',
+    'DROP TRIGGER comics_searchentry_ad',
+    'DROP TRIGGER comics_searchentry_ai',
+    'DROP TABLE comics_searchentry_fts',
+]
+
+# must match comics.search.PG_DOCUMENT for the planner to use it
+POSTGRESQL_FORWARD = [
+    """
+    CREATE INDEX comics_searchentry_document ON comics_searchentry
+    USING gin ((setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')))
+    """,
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX comics_searchentry_document',
+]
+
+
+def run_vendor_sql(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comics', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.CharField(max_length=20)),
+                ('title', models.CharField(max_length=500)),
+                ('body', models.TextField(blank=True)),
+                ('url', models.CharField(max_length=500)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchentry',
+            unique_together={('kind', 'object_id')},
+        ),
+        migrations.RunPython(
+            run_vendor_sql({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run_vendor_sql({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
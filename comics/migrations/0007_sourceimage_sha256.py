@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comics', '0006_searchentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourceimage',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comics', '0007_sourceimage_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjobfile',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjobfile',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjobfile',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
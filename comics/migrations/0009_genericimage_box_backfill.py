@@ -0,0 +1,35 @@
+from django.core.files.images import get_image_dimensions
+from django.db import migrations
+from django.db.models import F, Q
+
+
+#########################################
+# GenericImage Boxes                    #
+#########################################
+
+def fill_boxes(apps, schema_editor):
+    # the default crop box, stored from now on at save time, for older rows
+    model = apps.get_model('comics', 'GenericImage')
+    for image in model.objects.filter(Q(x2__lte=F('x1')) | Q(y2__lte=F('y1'))).iterator():
+        try:
+            with image.src.open('rb') as src:
+                width, height = get_image_dimensions(src)
+        except (OSError, ValueError):
+            continue
+        if width and height:
+            model.objects.filter(pk=image.pk).update(x1=0, y1=0, x2=width, y2=height)
+
+
+#########################################
+# Migration                             #
+#########################################
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comics', '0008_importjobfile_sniffed'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_boxes, migrations.RunPython.noop),
+    ]
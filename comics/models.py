@@ -1,16 +1,19 @@
 import re
+from functools import partial
 from io import BytesIO
-from itertools import chain
 from pathlib import Path
 
 import shortuuid
-from PIL import Image
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.db import models
-from django.db.models import Q, OuterRef
-from django.db.models.signals import pre_save
+from django.db import models, connections, transaction
+from django.db.models import Q, OuterRef, Subquery, F, Prefetch, Window
+from django.db.models.functions import Lag, Lead
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import Truncator, capfirst
 
 from comics.expressions import SQCount
@@ -41,6 +44,23 @@ THREAD_TYPE_CHOICES = (
 )
 
 
+PENDING = 'P'
+RUNNING = 'R'
+DONE = 'D'
+FAILED = 'F'
+JOB_STATUS_CHOICES = (
+    (PENDING, 'Pending'),
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed'),
+)
+
+NEIGHBOR_FIELDS = (
+    'prev_id', 'prev_number', 'prev_ordinal',
+    'next_id', 'next_number', 'next_ordinal',
+)
+
+
 #########################################
 # Utility Methods                       #
 #########################################
@@ -81,6 +101,13 @@ def gen_arch_loc(installment, filename):
                                        fnp.suffix)
 
 
+def gen_job_loc(instance, filename):
+    fnp = Path(filename)
+    return 'imports/{}/{}{}'.format(instance.job_id,
+                                    slugify_filename(fnp.stem),
+                                    fnp.suffix)
+
+
 # TODO: put this in the subclasses of SourceImage
 def gen_src_loc(instance, filename):
     ext = Path(filename).suffix.lower()
@@ -105,11 +132,17 @@ class ImageFileMixin(object):
 
     @property
     def image_width(self):
-        return self.safe_file.width
+        return self.safe_size[0]
 
     @property
     def image_height(self):
-        return self.safe_file.height
+        return self.safe_size[1]
+
+    @property
+    def safe_size(self):
+        # NOTE: subclasses should read their stored columns instead; this has
+        #       to open and parse the image header every single time
+        return self.safe_file.width, self.safe_file.height
 
 
 class GenericImage(ImageFileMixin, ShortUUIDMixin, models.Model):
@@ -163,23 +196,31 @@ class GenericImage(ImageFileMixin, ShortUUIDMixin, models.Model):
     def safe_file(self):
         return self.scaled
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if self.src is not None and self.box is None:
-            image = getattr(self.src, 'image', None)
-            if image:
-                self.box = (0, 0, image.width, image.height)
+    @property
+    def safe_size(self):
+        # NOTE: empty on rows page_dimensions hasn't been run over yet
+        if self.scaled_width and self.scaled_height:
+            return self.scaled_width, self.scaled_height
+        return super().safe_size
 
 
 # noinspection PyUnusedLocal
 @receiver(pre_save, sender=GenericImage)
 def scaled_img_pre_save_handler(sender, instance, **kwargs):
-    if instance.scaled:
+    from PIL import Image
+
+    if instance.scaled and instance.box is not None:
         return
 
     buf = BytesIO()
     # can't use instance.src(.file).image for some reason, so have to reopen
     with Image.open(instance.src.file) as src:
+        # default to the whole image, stored so that loading never has to decode
+        if instance.box is None:
+            instance.box = (0, 0, src.width, src.height)
+        if instance.scaled:
+            return
+
         try:
             crop = src.resize(instance.size, Image.LANCZOS, instance.box)
         except TypeError:
@@ -203,11 +244,25 @@ class SourceImage(ImageFileMixin, models.Model):
     original_name = models.CharField(
         max_length=260,
     )
+    # lets a re-import tell which pages actually changed
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        editable=False,
+    )
 
     @property
     def safe_file(self):
         return self.file
 
+    @property
+    def safe_size(self):
+        # NOTE: empty on rows page_dimensions hasn't been run over yet
+        if self.file_width and self.file_height:
+            return self.file_width, self.file_height
+        return super().safe_size
+
 
 #########################################
 # Series & Installments                 #
@@ -242,16 +297,57 @@ class InstallmentLabel(models.Model):
 class ThreadMixin(object):
     @property
     def num_pages(self):
-        return self.pages.count()
+        return self.page_count
 
 
-class SeriesDisplayManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset() \
-            .annotate(installment_count=Series.installment_count_sq())
+class CountCacheMixin(object):
+    count_fields = ()
 
+    def save(self, *args, **kwargs):
+        # counts are only ever written through F() updates by the signal
+        # handlers, never from what may well be a stale instance
+        if not self._state.adding and not kwargs.get('force_insert') \
+                and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in self.count_fields]
+        super().save(*args, **kwargs)
 
-class Series(ShortUUIDMixin, ThreadMixin, models.Model):
+
+def touch(queryset):
+    # NOTE: a bare UPDATE, so that bumping a parent never cascades any further
+    #       through its own signal handlers; callers bump each ancestor
+    return queryset.update(updated_at=timezone.now())
+
+
+def cover_prefetch():
+    return Prefetch('pages',
+                    queryset=Page.objects.filter(order=0),
+                    to_attr='prefetched_covers')
+
+
+class SeriesQuerySet(models.QuerySet):
+    def update_installment_counts(self):
+        # for after bulk operations, which skip the signal handlers
+        return self.update(installment_count=Series.installment_count_sq())
+
+    def with_cover(self, latest=False):
+        # fetch the first (or last) Installment of every Series in one query,
+        # and then all of their covers in one more
+        edge = Installment.objects \
+            .filter(series=OuterRef('series')) \
+            .order_by('-ordinal' if latest else 'ordinal') \
+            .values('ordinal')[:1]
+        installments = Installment.objects \
+            .annotate(edge_ordinal=Subquery(edge)) \
+            .filter(ordinal=F('edge_ordinal')) \
+            .with_cover()
+        to_attr = 'prefetched_latest' if latest else 'prefetched_first'
+        return self.prefetch_related(Prefetch('installments',
+                                              queryset=installments,
+                                              to_attr=to_attr))
+
+
+class Series(ShortUUIDMixin, ThreadMixin, CountCacheMixin, models.Model):
     name = models.CharField(
         max_length=250,
         help_text='The core name / title on the "cover" of all Installments.'
@@ -277,6 +373,14 @@ class Series(ShortUUIDMixin, ThreadMixin, models.Model):
         choices=FLIP_DIRECTION_CHOICES,
         default=LTR,
     )
+    installment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Denormalized; maintained by signal handlers.',
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
 
     @property
     def uuid(self):
@@ -286,14 +390,22 @@ class Series(ShortUUIDMixin, ThreadMixin, models.Model):
     @property
     def first_cover(self):
         # TODO: what if the first few Installments don't have a cover?
-        return self.installments.first().cover
+        if hasattr(self, 'prefetched_first'):
+            installment = next(iter(self.prefetched_first), None)
+        else:
+            installment = self.installments.first()
+        return installment.cover if installment else None
 
     @property
     def latest_cover(self):
-        return self.installments.last().cover
+        if hasattr(self, 'prefetched_latest'):
+            installment = next(iter(self.prefetched_latest), None)
+        else:
+            installment = self.installments.last()
+        return installment.cover if installment else None
 
-    objects = models.Manager()
-    display_objects = SeriesDisplayManager()
+    objects = SeriesQuerySet.as_manager()
+    count_fields = ('installment_count',)
 
     class Meta:
         verbose_name_plural = "series"
@@ -313,6 +425,11 @@ class Series(ShortUUIDMixin, ThreadMixin, models.Model):
         if self.is_strip:
             return self.installments.select_related('page')
 
+    @property
+    def page_count(self):
+        # strips are one page per Installment
+        return self.installment_count
+
     @staticmethod
     def installment_count_sq():
         return SQCount(Installment.objects
@@ -322,7 +439,56 @@ class Series(ShortUUIDMixin, ThreadMixin, models.Model):
                        )
 
 
-class Installment(ImageFileMixin, ShortUUIDMixin, ThreadMixin, models.Model):
+def neighbor_window(func, field, output_field=None):
+    # NOTE: Django wraps decimal functions in a CAST() on SQLite, which then
+    #       breaks the OVER clause; so keep that off the inner function
+    inner_field = models.FloatField() if output_field else None
+    return Window(expression=func(field, output_field=inner_field),
+                  partition_by=[F('series_id')],
+                  order_by=F('ordinal').asc(),
+                  output_field=output_field)
+
+
+class InstallmentQuerySet(models.QuerySet):
+    def with_neighbors(self):
+        # NOTE: only correct when whole Series are selected, e.g. listings
+        number_field = self.model._meta.get_field('number')
+        return self.annotate(
+            prev_id=neighbor_window(Lag, 'id'),
+            prev_number=neighbor_window(Lag, 'number', number_field),
+            prev_ordinal=neighbor_window(Lag, 'ordinal'),
+            next_id=neighbor_window(Lead, 'id'),
+            next_number=neighbor_window(Lead, 'number', number_field),
+            next_ordinal=neighbor_window(Lead, 'ordinal'),
+        )
+
+    def neighbors_of(self, pk):
+        """
+        NEIGHBOR_FIELDS of the one Installment, or {} if it isn't among these.
+        """
+        # NOTE: a WHERE on the windowed query itself would run before the
+        #       window does, so it goes around it in a derived table instead
+        compiler = self.with_neighbors().values_list('pk', *NEIGHBOR_FIELDS).query.get_compiler(self.db)
+        try:
+            sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            return {}
+        qn = compiler.quote_name_unless_alias
+        with connections[self.db].cursor() as cursor:
+            cursor.execute('SELECT * FROM ({}) {} WHERE {} = %s'.format(
+                sql, qn('windowed'), qn(self.model._meta.pk.column)), params + (pk,))
+            rows = list(compiler.results_iter([cursor.fetchall()]))
+        return dict(zip(NEIGHBOR_FIELDS, rows[0][1:])) if rows else {}
+
+    def update_page_counts(self):
+        # for after bulk operations, which skip the signal handlers
+        return self.update(page_count=Installment.page_count_sq())
+
+    def with_cover(self):
+        return self.prefetch_related(cover_prefetch())
+
+
+class Installment(ImageFileMixin, ShortUUIDMixin, ThreadMixin, CountCacheMixin, models.Model):
     # NOTE: changing these may require a DB migration
     FIRST_NUMBER = 5
     SECOND_NUMBER = 5
@@ -373,6 +539,17 @@ class Installment(ImageFileMixin, ShortUUIDMixin, ThreadMixin, models.Model):
         editable=False,
         null=True,
     )
+    page_count = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        help_text='Denormalized; maintained by signal handlers.',
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+    objects = InstallmentQuerySet.as_manager()
+    count_fields = ('page_count',)
 
     class Meta:
         ordering = ['ordinal']
@@ -381,6 +558,13 @@ class Installment(ImageFileMixin, ShortUUIDMixin, ThreadMixin, models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the loaded Series, so a move can fix up both counts
+        instance._loaded_series_id = instance.__dict__.get('series_id')
+        return instance
+
     def get_url_kwargs(self):
         kwargs = self.series.get_url_kwargs()
         if self.number is not None:
@@ -423,23 +607,28 @@ class Installment(ImageFileMixin, ShortUUIDMixin, ThreadMixin, models.Model):
 
     @property
     def cover(self):
-        return self.pages.first() if self.has_cover else None
+        if not self.has_cover:
+            return None
+        if hasattr(self, 'prefetched_covers'):
+            return next(iter(self.prefetched_covers), None)
+        return self.pages.first()
 
     @property
     def is_paginated(self):
-        # TODO: this is stupidly inefficient
-        return self.num_pages > 1
+        return self.page_count > 1
+
+    def load_neighbors(self):
+        # the window runs over the whole Series; still just the one query for both sides
+        row = Installment.objects \
+            .filter(series_id=self.series_id) \
+            .neighbors_of(self.pk)
+        for field in NEIGHBOR_FIELDS:
+            setattr(self, field, row.get(field))
 
     @property
     def prev_id(self):
         if not hasattr(self, '_prev_id'):
-            try:
-                prev_idx = self.ordinal - 2  # 1-indexed, so yeah...
-                self._prev_id = self.series.installments \
-                    .order_by('ordinal') \
-                    .values_list('pk', flat=True)[prev_idx]
-            except (AssertionError, IndexError):
-                self._prev_id = None
+            self.load_neighbors()
         return self._prev_id
 
     @prev_id.setter
@@ -448,35 +637,61 @@ class Installment(ImageFileMixin, ShortUUIDMixin, ThreadMixin, models.Model):
 
     @property
     def next_id(self):
-        # TODO: use a LEAD() window function in certain circumstances?
         if not hasattr(self, '_next_id'):
-            try:
-                next_idx = self.ordinal  # 1-indexed, so yeah...
-                self._next_id = self.series.installments \
-                    .order_by('ordinal') \
-                    .values_list('pk', flat=True)[next_idx]
-            except IndexError:
-                self._next_id = None
+            self.load_neighbors()
         return self._next_id
 
     @next_id.setter
     def next_id(self, value):
         self._next_id = value
 
+    def get_neighbor_url_kwargs(self, side):
+        if getattr(self, side + '_id') is None:
+            return None
+        kwargs = self.series.get_url_kwargs()
+        number = getattr(self, side + '_number')
+        if number is not None:
+            kwargs['number'] = number
+        else:
+            kwargs['ordinal'] = getattr(self, side + '_ordinal')
+        return kwargs
+
     @property
-    def page_count(self):
-        if not hasattr(self, '_pc'):
-            self._pc = self.pages.count()
-        return self._pc
+    def prev_url_kwargs(self):
+        return self.get_neighbor_url_kwargs('prev')
+
+    @property
+    def next_url_kwargs(self):
+        return self.get_neighbor_url_kwargs('next')
 
-    @page_count.setter
-    def page_count(self, value):
-        self._pc = value
+    @staticmethod
+    def page_count_sq():
+        return SQCount(Page.objects
+                       .order_by()
+                       .filter(installment=OuterRef('pk'))
+                       .values('pk')
+                       )
 
     @property
     def safe_file(self):
         return self.page.file
 
+    @property
+    def safe_size(self):
+        return self.page.safe_size
+
+
+class PageQuerySet(models.QuerySet):
+    def in_thread(self, thread):
+        # NOTE: one filter() call, so every condition lands on the same join
+        #       and a Page is matched against its own sequence's range only
+        seq = 'installment__threadsequence__'
+        return self \
+            .filter(Q(**{seq + 'thread': thread}),
+                    Q(order__gte=F(seq + 'begin_page')),
+                    Q(**{seq + 'end_page__isnull': True}) | Q(order__lte=F(seq + 'end_page'))) \
+            .order_by(seq + 'order', 'order')
+
 
 class Page(SourceImage):
     installment = models.ForeignKey(
@@ -489,6 +704,11 @@ class Page(SourceImage):
         default=0,
         editable=False,
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+    objects = PageQuerySet.as_manager()
 
     class Meta:
         # NOTE: don't add order to uniqueness constraint (See: goo.gl/nnctw0)
@@ -497,6 +717,13 @@ class Page(SourceImage):
     def __str__(self):
         return "{}".format(self.order)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the loaded Installment, so a move can fix up both counts
+        instance._loaded_installment_id = instance.__dict__.get('installment_id')
+        return instance
+
     def get_url_kwargs(self):
         kwargs = self.installment.get_url_kwargs()
         kwargs['page'] = self.order
@@ -514,6 +741,100 @@ class Page(SourceImage):
         return self.order if self.installment.has_cover else self.order + 1
 
 
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Installment)
+def installment_post_save_handler(sender, instance, created, raw, **kwargs):
+    # NOTE: post_save, so a save that fails never gets to touch the counts
+    loaded_id = getattr(instance, '_loaded_series_id', None)
+    instance._loaded_series_id = instance.series_id
+    if raw:
+        return
+
+    now = timezone.now()
+    series = Series.objects.filter(pk=instance.series_id)
+    if created or (loaded_id is not None and loaded_id != instance.series_id):
+        series.update(installment_count=F('installment_count') + 1, updated_at=now)
+        if not created:
+            # moving between Series
+            Series.objects.filter(pk=loaded_id).update(installment_count=F('installment_count') - 1, updated_at=now)
+    else:
+        touch(series)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_delete, sender=Installment)
+def installment_post_delete_handler(sender, instance, **kwargs):
+    Series.objects \
+        .filter(pk=instance.series_id) \
+        .update(installment_count=F('installment_count') - 1, updated_at=timezone.now())
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=InstallmentLabel)
+def installment_label_post_save_handler(sender, instance, created, raw, **kwargs):
+    # every Installment of the Series using it shows the label in its name
+    if raw or created:
+        return
+    touch(Installment.objects.filter(series__installment_label=instance))
+    touch(Series.objects.filter(installment_label=instance))
+
+
+# noinspection PyUnusedLocal
+@receiver(pre_save, sender=Page)
+def page_pre_save_handler(sender, instance, raw, **kwargs):
+    file = instance.file
+    if raw or not settings.CONTENT_ADDRESSED_PAGES or not file or file._committed:
+        return
+
+    # in place of the FieldFile saving it under gen_src_loc, which would also
+    # have filled in the dimensions from it
+    upload = file.file
+    if hasattr(upload, 'image_size'):
+        instance.file_width, instance.file_height = upload.image_size
+    else:
+        file.field.update_dimension_fields(instance, force=True)
+    file.name, instance.sha256, instance._blob_pin = file.storage.save_blob(
+        file, Path(file.name).suffix.lower(), getattr(upload, 'sha256', None))
+    file._committed = True
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Page)
+def page_post_save_handler(sender, instance, created, raw, **kwargs):
+    loaded_id = getattr(instance, '_loaded_installment_id', None)
+    instance._loaded_installment_id = instance.installment_id
+    pin = instance.__dict__.pop('_blob_pin', None)
+    if pin:
+        # once nothing can delete the blob out from under the row any more
+        transaction.on_commit(partial(instance.file.storage.release_blob, instance.file.name, pin))
+    if raw:
+        return
+
+    now = timezone.now()
+    installment = Installment.objects.filter(pk=instance.installment_id)
+    installment_ids = [instance.installment_id]
+    if created or (loaded_id is not None and loaded_id != instance.installment_id):
+        installment.update(page_count=F('page_count') + 1, updated_at=now)
+        if not created:
+            # moving between Installments
+            Installment.objects \
+                .filter(pk=loaded_id) \
+                .update(page_count=F('page_count') - 1, updated_at=now)
+            installment_ids.append(loaded_id)
+    else:
+        touch(installment)
+    touch(Series.objects.filter(installments__in=installment_ids))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_delete, sender=Page)
+def page_post_delete_handler(sender, instance, **kwargs):
+    Installment.objects \
+        .filter(pk=instance.installment_id) \
+        .update(page_count=F('page_count') - 1, updated_at=timezone.now())
+    touch(Series.objects.filter(installments=instance.installment_id))
+
+
 #########################################
 # Threads                               #
 #########################################
@@ -538,6 +859,9 @@ class Thread(ShortUUIDMixin, models.Model):
         'comics.Installment',
         through='comics.ThreadSequence',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
 
     def __str__(self):
         trunc = Truncator(self.name)
@@ -548,14 +872,11 @@ class Thread(ShortUUIDMixin, models.Model):
 
     @property
     def cover(self):
-        return self.threadsequence_set.first().first_page
+        return self.pages.first()
 
     @property
     def pages(self):
-        pages = chain()
-        for ts in self.threadsequence_set.iterator():
-            pages = chain(pages, ts.pages)
-        return list(pages)
+        return Page.objects.in_thread(self)
 
 
 class ThreadSequence(models.Model):
@@ -601,3 +922,124 @@ class ThreadSequence(models.Model):
                 Q(installment=self.installment),
                 Q(order__gte=self.begin_page),
             )
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=ThreadSequence)
+@receiver(post_delete, sender=ThreadSequence)
+def thread_sequence_changed_handler(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch(Thread.objects.filter(pk=instance.thread_id))
+
+
+#########################################
+# Import Jobs                           #
+#########################################
+
+class ImportJob(models.Model):
+    installment = models.ForeignKey(
+        'comics.Installment',
+        on_delete=models.CASCADE,
+        related_name='import_jobs',
+    )
+    status = models.CharField(
+        max_length=1,
+        choices=JOB_STATUS_CHOICES,
+        default=PENDING,
+    )
+    total_pages = models.PositiveSmallIntegerField(
+        default=0,
+    )
+    done_pages = models.PositiveSmallIntegerField(
+        default=0,
+    )
+    error = models.TextField(
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+    started_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return '{} [{}]'.format(self.installment, self.get_status_display())
+
+    @property
+    def progress(self):
+        if not self.total_pages:
+            return None
+        return self.done_pages / self.total_pages
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+
+class ImportJobFile(models.Model):
+    job = models.ForeignKey(
+        'comics.ImportJob',
+        on_delete=models.CASCADE,
+        related_name='files',
+    )
+    file = models.FileField(
+        upload_to=gen_job_loc,
+    )
+    original_name = models.CharField(
+        max_length=260,
+    )
+    # whatever the upload handler already worked out, so the import needn't
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+    )
+    image_width = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+    )
+    image_height = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        ordering = ['pk']
+
+
+#########################################
+# Search                                #
+#########################################
+
+class SearchEntry(models.Model):
+    # NOTE: the text itself is indexed outside of the ORM, by an FTS5 table on
+    #       SQLite or a tsvector expression index on PostgreSQL; see comics.search
+    kind = models.CharField(
+        max_length=20,
+    )
+    object_id = models.CharField(
+        max_length=20,
+    )
+    title = models.CharField(
+        max_length=500,
+    )
+    body = models.TextField(
+        blank=True,
+    )
+    url = models.CharField(
+        max_length=500,
+    )
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return '{} [{}]'.format(self.title, self.kind)
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+
+# NOTE: keep this module free of Django imports; it is loaded fresh by every
+#       spawned worker process, which has no configured settings.
+
+DEFAULT_MAX_CACHE_MEM = 64 * 1024 * 1024  # per worker, in bytes
+DEFAULT_IN_FLIGHT = 2  # pages queued up per worker, beyond the one rendering
+
+
+#########################################
+# Worker                                #
+#########################################
+
+def init_worker(max_cache_mem=DEFAULT_MAX_CACHE_MEM):
+    import pyvips
+
+    # every page is rendered exactly once, so the operation cache only ever
+    # holds on to memory; keep it small to bound the footprint of each worker
+    pyvips.cache_set_max(0)
+    pyvips.cache_set_max_mem(max_cache_mem)
+
+
+def rasterize_page(pdf_path, index, dest_path, dpi, save_kwargs):
+    import pyvips
+
+    # load only the one page, top to bottom, rather than the entire strip
+    page = pyvips.Image.new_from_file(pdf_path,
+                                      page=index,
+                                      n=1,
+                                      dpi=dpi,
+                                      access='sequential')
+
+    # That'll be RGBA ... flatten out the alpha
+    if page.hasalpha():
+        page = page.flatten(background=255)
+
+    page.write_to_file(dest_path, **save_kwargs)
+    return page.width, page.height
+
+
+#########################################
+# Pool                                  #
+#########################################
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+@contextmanager
+def local_pdf_path(pdf_file):
+    """Provide a filesystem path to the PDF that worker processes can open."""
+    if hasattr(pdf_file, 'temporary_file_path'):
+        yield pdf_file.temporary_file_path()
+        return
+
+    # FieldFiles on local storage already live on disk
+    try:
+        path = pdf_file.path
+    except (AttributeError, NotImplementedError, ValueError):
+        path = None
+    if path and os.path.exists(path):
+        yield path
+        return
+
+    if not hasattr(pdf_file, 'read'):
+        raise NotImplementedError('Unsure how to access file.')
+
+    # need to spool here because storage may not be local
+    with NamedTemporaryFile(suffix='.pdf') as tmp:
+        pdf_file.seek(0)
+        shutil.copyfileobj(pdf_file, tmp)
+        tmp.flush()
+        yield tmp.name
+
+
+def rasterize_pages(pdf_path, n_pages, make_file, dpi=300, workers=None,
+                    save_kwargs=None):
+    """
+    Render each page of a PDF in a pool of worker processes, yielding
+    ``(index, file, (width, height))`` in page order.
+
+    ``make_file(index)`` must return an open file with a
+    ``temporary_file_path()`` for the worker to write the page into.
+    """
+    workers = workers or default_workers()
+    save_kwargs = save_kwargs or {}
+    # only a bounded window of pages is ever queued or sitting on disk
+    window = workers * DEFAULT_IN_FLIGHT
+
+    # forking a process with libvips' threads already running is asking for
+    # trouble, so start each worker with a clean interpreter instead
+    ctx = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=ctx,
+                             initializer=init_worker) as pool:
+        pages = iter(range(n_pages))
+        pending = deque()
+
+        def submit_next():
+            i = next(pages, None)
+            if i is None:
+                return
+            file = make_file(i)
+            future = pool.submit(rasterize_page,
+                                 pdf_path,
+                                 i,
+                                 file.temporary_file_path(),
+                                 dpi,
+                                 save_kwargs)
+            pending.append((i, file, future))
+
+        for _ in range(window):
+            submit_next()
+
+        try:
+            while pending:
+                i, file, future = pending.popleft()
+                with file:
+                    dims = future.result()
+                    submit_next()
+                    yield i, file, dims
+        finally:
+            # generator was abandoned (or a page failed); drop the rest, but let
+            # any page already rendering finish before its file goes away
+            for _, file, future in pending:
+                if not future.cancel():
+                    future.exception()
+                file.close()
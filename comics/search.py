@@ -0,0 +1,261 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q, Value, FloatField
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from comics.models import Series, Installment, InstallmentLabel, SearchEntry
+from metadata.models import Character, Persona, Creator
+
+SEARCH_LIMIT = 50
+
+# title matches count for more than body ones
+SQLITE_WEIGHTS = (10.0, 1.0)
+# NOTE: must match the expression index in comics/migrations/0006_searchentry
+PG_DOCUMENT = "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')"
+# divides by 1 + log(length), so that like bm25 longer documents don't win just by being long
+PG_RANK_NORMALIZATION = 1
+
+
+#########################################
+# Documents                             #
+#########################################
+
+# each returns (title, body) for an object, or None to leave it out
+
+def series_document(series):
+    return series.name, series.slug
+
+
+def installment_document(installment):
+    return installment.name, ' '.join([installment.series.slug, installment.synopsis])
+
+
+def character_document(character):
+    # NOTE: Characters are created before their primary Persona, so wait for it
+    if character.primary_persona is None:
+        return None
+    words = []
+    for persona in character.personas.prefetch_related('creators'):
+        if persona.pk != character.primary_persona_id:
+            words.append(persona.name)
+        if persona.cls_name:
+            words.append(persona.cls_name)
+        words += [creator.working_name for creator in persona.creators.all()]
+    words.append(character.bio)
+    return character.name, ' '.join(words)
+
+
+def creator_document(creator):
+    return creator.working_name, ''
+
+
+SEARCH_KINDS = {
+    'series': (Series, series_document),
+    'installment': (Installment, installment_document),
+    'character': (Character, character_document),
+    'creator': (Creator, creator_document),
+}
+MODEL_KINDS = {model: kind for kind, (model, _) in SEARCH_KINDS.items()}
+SEARCH_MIGRATION = ('comics', '0006_searchentry')
+
+
+#########################################
+# Indexing                              #
+#########################################
+
+def index_object(instance):
+    kind = MODEL_KINDS[instance.__class__]
+    document = SEARCH_KINDS[kind][1](instance)
+    if document is None:
+        unindex_object(instance)
+        return
+
+    title, body = document
+    SearchEntry.objects.update_or_create(
+        kind=kind,
+        object_id=instance.pk,
+        defaults={
+            'title': title[:500],
+            'body': body,
+            'url': instance.get_absolute_url(),
+        },
+    )
+
+
+def unindex_object(instance):
+    SearchEntry.objects \
+        .filter(kind=MODEL_KINDS[instance.__class__], object_id=instance.pk) \
+        .delete()
+
+
+def index_queryset(queryset):
+    for instance in queryset:
+        index_object(instance)
+
+
+@transaction.atomic
+def rebuild_index():
+    SearchEntry.objects.all().delete()
+    for model, _ in SEARCH_KINDS.values():
+        index_queryset(model.objects.all())
+    return SearchEntry.objects.count()
+
+
+def search_migrated_handler(sender, verbosity=1, plan=None, **kwargs):
+    # NOTE: the migration that makes the index can't fill it, as the documents
+    #       need the models' own properties and URLs, which historical models
+    #       don't have; without this, the admin search boxes find nothing
+    if any((migration.app_label, migration.name) == SEARCH_MIGRATION and not backwards
+           for migration, backwards in plan or []):
+        count = rebuild_index()
+        if verbosity >= 2:
+            print('Indexed {} object(s) for search.'.format(count))
+
+
+#########################################
+# Searching                             #
+#########################################
+
+def get_terms(query):
+    # NOTE: words only, which keeps FTS5 and tsquery operators out of it
+    return re.findall(r'\w+', query.lower())
+
+
+def search_sqlite(terms):
+    match = ' '.join('"{}"*'.format(term) for term in terms)
+    sql = '''
+        SELECT  e.*,
+                bm25(comics_searchentry_fts, %s, %s) AS rank
+        FROM    comics_searchentry_fts f INNER JOIN comics_searchentry e
+                                         ON         e.id = f.rowid
+        WHERE   comics_searchentry_fts MATCH %s {kinds}
+        ORDER   BY rank
+        {limit}
+        '''
+    return sql, list(SQLITE_WEIGHTS) + [match]
+
+
+def search_postgresql(terms):
+    tsquery = ' & '.join('{}:*'.format(term) for term in terms)
+    sql = '''
+        SELECT  e.*,
+                ts_rank({document}, q, {normalization}) AS rank
+        FROM    comics_searchentry e,
+                to_tsquery('english', %s) q
+        WHERE   ({document}) @@ q {{kinds}}
+        ORDER   BY rank DESC
+        {{limit}}
+        '''.format(document=PG_DOCUMENT, normalization=PG_RANK_NORMALIZATION)
+    return sql, [tsquery]
+
+
+def search_entries(query, kinds=None, limit=SEARCH_LIMIT):
+    """
+    Ranked SearchEntries matching all of the words in query, each of which
+    may also just be the start of a longer word. They have a rank attribute.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return []
+
+    vendor_search = {
+        'sqlite': search_sqlite,
+        'postgresql': search_postgresql,
+    }.get(connection.vendor)
+    if vendor_search is None:
+        # no full-text index; at least find what's there
+        entries = SearchEntry.objects.annotate(rank=Value(0, output_field=FloatField()))
+        for term in terms:
+            entries = entries.filter(Q(title__icontains=term) | Q(body__icontains=term))
+        if kinds:
+            entries = entries.filter(kind__in=kinds)
+        return list(entries.order_by('title')[:limit])
+
+    sql, params = vendor_search(terms)
+    kinds_sql = ''
+    if kinds:
+        kinds_sql = 'AND e.kind IN ({})'.format(', '.join(['%s'] * len(kinds)))
+        params += list(kinds)
+    limit_sql = ''
+    if limit is not None:
+        limit_sql = 'LIMIT %s'
+        params.append(limit)
+    return list(SearchEntry.objects.raw(sql.format(kinds=kinds_sql, limit=limit_sql), params))
+
+
+#########################################
+# Signals                               #
+#########################################
+
+def index_characters(queryset):
+    index_queryset(queryset.select_related('primary_persona').distinct())
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Series)
+@receiver(post_save, sender=Installment)
+@receiver(post_save, sender=Character)
+@receiver(post_save, sender=Creator)
+def indexed_saved_handler(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    index_object(instance)
+    if sender is Series:
+        # Installment titles start with the Series name
+        index_queryset(instance.installments.select_related('series__installment_label'))
+    elif sender is Creator:
+        index_characters(Character.objects.filter(personas__creators=instance))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_delete, sender=Series)
+@receiver(post_delete, sender=Installment)
+@receiver(post_delete, sender=Character)
+@receiver(post_delete, sender=Creator)
+def indexed_deleted_handler(sender, instance, **kwargs):
+    unindex_object(instance)
+    if sender is Creator:
+        index_characters(Character.objects.filter(pk__in=instance._search_character_ids))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=InstallmentLabel)
+def installment_label_indexed_handler(sender, instance, created, raw=False, **kwargs):
+    if not (raw or created):
+        # Installment titles include the label
+        index_queryset(Installment.objects
+                       .filter(series__installment_label=instance)
+                       .select_related('series__installment_label'))
+
+
+# noinspection PyUnusedLocal
+@receiver(pre_delete, sender=Creator)
+def creator_deleting_handler(sender, instance, **kwargs):
+    # NOTE: the m2m rows are gone by post_delete, without an m2m_changed
+    instance._search_character_ids = list(Character.objects
+                                          .filter(personas__creators=instance)
+                                          .values_list('pk', flat=True))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Persona)
+@receiver(post_delete, sender=Persona)
+def persona_indexed_handler(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_characters(Character.objects.filter(pk=instance.character_id))
+
+
+# noinspection PyUnusedLocal
+@receiver(m2m_changed, sender=Persona.creators.through)
+def persona_creators_indexed_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_characters(Character.objects.filter(pk=instance.character_id))
+    elif action == 'pre_clear':
+        # NOTE: pk_set is None when clearing, so look up the Personas beforehand
+        instance._search_persona_ids = list(instance.personas.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        persona_ids = instance._search_persona_ids if action == 'post_clear' else pk_set
+        index_characters(Character.objects.filter(personas__in=persona_ids))
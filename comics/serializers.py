@@ -1,7 +1,9 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.fields import CharField
 
 from comics.models import Page, Installment, Series
+from metadata.models import Appearance
 from metadata.serializers import PageAppearanceSerializer
 
 PAGE_FIELDS = ('image_url', 'image_width', 'image_height',)
@@ -24,6 +26,17 @@ class InstallmentSerializer(serializers.ModelSerializer):
         model = Installment
         fields = THREAD_FIELDS + ('series', 'title', 'synopsis', 'has_cover',)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # the whole payload in a fixed number of queries, however many pages
+        # NOTE: the default ordering leaves one page's own appearances in whatever
+        #       order the backend likes
+        appearances = Appearance.objects.select_related('persona').order_by('pk')
+        pages = Page.objects.prefetch_related(Prefetch('appearances', queryset=appearances))
+        return queryset \
+            .select_related('series__installment_label') \
+            .prefetch_related(Prefetch('pages', queryset=pages))
+
 
 class StripInstallmentSerializer(serializers.ModelSerializer):
     class Meta:
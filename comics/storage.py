@@ -0,0 +1,324 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db.models import Count
+
+from comics.util import s_uuid, file_sha256
+
+BLOB_DIR = 'blobs'
+REFERENCE_CHUNK = 400
+COPY_CHUNK = 1024 * 1024
+
+
+#########################################
+# Local Files                           #
+#########################################
+
+# NOTE: a file that's already on disk is moved or linked into storage rather
+#       than copied: a temporary one (anything with temporary_file_path) is
+#       moved, while one with a local_path, such as a staged import, is left
+#       where it is and linked to
+
+def get_local_source(content):
+    if hasattr(content, 'temporary_file_path'):
+        return content.temporary_file_path(), False
+    local_path = getattr(content, 'local_path', None)
+    if local_path:
+        return local_path, True
+    return None
+
+
+def place_file(src, dst, keep):
+    """
+    Puts the file at src in place at dst, which mustn't exist yet, by a hard
+    link; unless keep, src is then removed, which makes it a move. Copies it
+    where there can't be a link, e.g. between filesystems.
+    """
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+    if not keep:
+        os.remove(src)
+
+
+def local_temp_dir(storage=default_storage):
+    # somewhere temporary files can be moved into storage from by a rename,
+    # without being served along with the media
+    try:
+        storage.path('')
+    except NotImplementedError:
+        return None
+    if not settings.MEDIA_TEMP_DIR:
+        return None
+    os.makedirs(settings.MEDIA_TEMP_DIR, exist_ok=True)
+    return settings.MEDIA_TEMP_DIR
+
+
+def clean_temp_dir(max_age, path=None):
+    """
+    Removes the files left in MEDIA_TEMP_DIR, e.g. by a worker that died
+    mid-upload, not modified for max_age seconds. Returns their paths.
+    """
+    path = path or settings.MEDIA_TEMP_DIR
+    if not path or not os.path.isdir(path):
+        return []
+    cutoff = time.time() - max_age
+    removed = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed.append(entry.path)
+            except FileNotFoundError:
+                # already closed and removed by its owner
+                pass
+    return removed
+
+
+def stage_file(content, storage=default_storage):
+    """
+    Keeps the bytes of content in MEDIA_TEMP_DIR until a StagedFile of them
+    is saved; where anything left behind by a crash gets cleared out along
+    with the other temporary files. Moved or linked there if it's on disk
+    already; otherwise written out, and hashed on the way. Returns the path,
+    and the hash or None.
+    """
+    path = os.path.join(local_temp_dir(storage) or tempfile.gettempdir(),
+                        s_uuid(16) + '.staged' + Path(content.name).suffix)
+    source = get_local_source(content)
+    if source is not None:
+        src, keep = source
+        place_file(src, path, keep)
+        # NOTE: a link shares the source's mtime, which clean_temp_dir goes by
+        os.utime(path)
+        return path, None
+
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'xb') as fp:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                fp.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+class StagedFile(File):
+    """
+    A file from stage_file(), which storage moves into place the same as a
+    temporary upload; closing it removes whatever wasn't.
+    """
+    def __init__(self, path, name):
+        super().__init__(open(path, 'rb'), name)
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            self.file.close()
+        finally:
+            try:
+                os.remove(self.file.name)
+            except FileNotFoundError:
+                pass
+
+
+class MediaTemporaryFile(TemporaryUploadedFile):
+    """
+    TemporaryUploadedFile kept in MEDIA_TEMP_DIR, where the media are local,
+    rather than in FILE_UPLOAD_TEMP_DIR.
+    """
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + Path(name).suffix,
+                                           dir=local_temp_dir() or settings.FILE_UPLOAD_TEMP_DIR)
+        # NOTE: skips TemporaryUploadedFile's own, which makes the file itself
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+
+
+#########################################
+# Content-Addressed Files               #
+#########################################
+
+def blob_name(sha256, ext):
+    # sharded two levels deep, so no one directory ends up with every page
+    return '{}/{}/{}/{}{}'.format(BLOB_DIR, sha256[:2], sha256[2:4], sha256, ext)
+
+
+def is_blob_name(name):
+    return name.startswith(BLOB_DIR + '/')
+
+
+def count_references(names):
+    """
+    How many SourceImages point at each of the given blobs; the ones no longer
+    referenced at all are left out.
+    """
+    from comics.models import SourceImage
+
+    names = list(names)
+    refs = {}
+    # chunked, to stay under the backend's limit on query parameters
+    for i in range(0, len(names), REFERENCE_CHUNK):
+        chunk = names[i:i + REFERENCE_CHUNK]
+        refs.update(SourceImage.objects
+                    # NOTE: sha256 is indexed, file isn't
+                    .filter(sha256__in=[Path(name).stem for name in chunk], file__in=chunk)
+                    .values_list('file')
+                    .annotate(refs=Count('pk'))
+                    .order_by())
+    return refs
+
+
+#########################################
+# Storage                               #
+#########################################
+
+class MediaStorage(FileSystemStorage):
+    """
+    FileSystemStorage that moves or links files already on disk into place,
+    and that can also keep files by their content: each one once, under its
+    SHA-256, however many SourceImages share it.
+    """
+    def _save(self, name, content):
+        source = get_local_source(content)
+        if source is None:
+            return super()._save(name, content)
+
+        src, keep = source
+        full_path = self.path(name)
+        self.make_directory(os.path.dirname(full_path))
+        while True:
+            try:
+                place_file(src, full_path, keep)
+                break
+            except FileExistsError:
+                # same as FileSystemStorage, which lost a race for the name
+                name = self.get_available_name(name)
+                full_path = self.path(name)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name.replace('\\', '/')
+
+    def make_directory(self, directory):
+        # same as FileSystemStorage._save, with directory_permissions_mode, only
+        # also for the intermediate directories, which os.makedirs leaves out
+        if os.path.isdir(directory):
+            return
+        self.make_directory(os.path.dirname(directory))
+        if self.directory_permissions_mode is None:
+            os.makedirs(directory, exist_ok=True)
+            return
+        # os.mkdir applies the umask, so it's cleared in the meantime
+        old_umask = os.umask(0)
+        try:
+            os.mkdir(directory, self.directory_permissions_mode)
+        except FileExistsError:
+            pass
+        finally:
+            os.umask(old_umask)
+
+    def save_blob(self, content, ext, sha256=None):
+        """
+        Stores content under its own hash, hashing it while it's being written
+        rather than reading it twice; or, if it's already on disk, by reading
+        it and moving or linking it into place. Returns the blob's name, the
+        hash, and a pin: the path of a link to the same bytes, which has to be
+        handed to release_blob() once the row using the blob is committed.
+        """
+        # NOTE: a delete can't see the row until it's committed, so it may
+        #       well take the blob away in the meantime; the pin keeps its
+        #       bytes, and releasing it puts the blob back if need be
+        pin = os.path.join(local_temp_dir(self) or tempfile.gettempdir(), s_uuid(16) + ext)
+        source = get_local_source(content)
+        if source is not None and not sha256:
+            sha256 = file_sha256(content)
+        if sha256:
+            # already hashed on the way in, and maybe already here
+            name = blob_name(sha256, ext)
+            try:
+                place_file(self.path(name), pin, keep=True)
+                # NOTE: a link shares the blob's mtime, which clean_temp_dir goes by
+                os.utime(pin)
+                return name, sha256, pin
+            except FileNotFoundError:
+                pass
+            if source is not None:
+                src, keep = source
+                place_file(src, pin, keep)
+                os.utime(pin)
+                self.place_blob(pin, name)
+                return name, sha256, pin
+
+        digest = hashlib.sha256()
+        try:
+            with open(pin, 'xb') as fp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    fp.write(chunk)
+        except BaseException:
+            os.remove(pin)
+            raise
+        sha256 = digest.hexdigest()
+        name = blob_name(sha256, ext)
+        self.place_blob(pin, name)
+        return name, sha256, pin
+
+    def place_blob(self, src, name):
+        # leaves src as it is; a link where it can be, otherwise a copy
+        path = self.path(name)
+        self.make_directory(os.path.dirname(path))
+        if self.file_permissions_mode is not None:
+            os.chmod(src, self.file_permissions_mode)
+        try:
+            place_file(src, path, keep=True)
+        except FileExistsError:
+            # the same bytes, just put there by another import
+            pass
+
+    def release_blob(self, name, pin):
+        """
+        Lets go of a pin from save_blob(), first putting the blob back should
+        a delete have taken it while its row was being written.
+        """
+        try:
+            self.place_blob(pin, name)
+        finally:
+            os.remove(pin)
+
+    def delete(self, name):
+        if not (name and is_blob_name(name)):
+            return super().delete(name)
+
+        # shared blobs only go once the last SourceImage using them has
+        if count_references([name]):
+            return
+        # NOTE: set aside and counted again, as a row using it may have been
+        #       committed since; otherwise its pin would already be gone
+        path = self.path(name)
+        aside = os.path.join(local_temp_dir(self) or os.path.dirname(path), s_uuid(16) + '.deleted')
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return
+        try:
+            if count_references([name]):
+                self.place_blob(aside, name)
+        finally:
+            os.remove(aside)
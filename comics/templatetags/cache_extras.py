@@ -0,0 +1,62 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from comics.conditional import latest_stamp
+
+FRAGMENT_CACHE_PREFIX = 'fragment'
+
+
+def get_dep_version(dep):
+    # querysets cost one aggregate query, which is the point: far less than
+    # whatever the fragment would otherwise run to render them
+    if isinstance(dep, models.QuerySet):
+        return (dep.model._meta.label,) + latest_stamp(dep)
+    if isinstance(dep, models.Model):
+        return dep._meta.label, dep.pk, getattr(dep, 'updated_at', None)
+    return dep
+
+
+def get_fragment_key(name, deps):
+    versions = repr([get_dep_version(dep) for dep in deps])
+    digest = hashlib.md5(versions.encode()).hexdigest()
+    return '{}:{}:{}'.format(FRAGMENT_CACHE_PREFIX, name, digest)
+
+
+class FragmentCacheExtension(Extension):
+    """
+    {% cache 'name', dep1, dep2... %}...{% endcache %}
+
+    Model instances and querysets among the deps are versioned by their
+    updated_at timestamps, so the fragment is re-rendered once any of them
+    change; anything else is used as part of the key as-is.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    @staticmethod
+    def _cache_support(args, caller):
+        cache = caches[settings.FRAGMENT_CACHE_ALIAS]
+        key = get_fragment_key(args[0], args[1:])
+
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = str(caller())
+            cache.set(key, fragment, settings.FRAGMENT_CACHE_TIMEOUT)
+        # already escaped when it was rendered
+        return Markup(fragment)
@@ -1,7 +1,7 @@
 import json
+from functools import lru_cache
 from itertools import groupby
 
-import inflect as inflect
 from django import template
 from django.utils.encoding import force_text
 from django.utils.html import conditional_escape
@@ -10,7 +10,6 @@ from jinja2 import environmentfilter
 from jinja2.filters import make_attrgetter, _GroupTuple
 
 register = template.Library()
-p = inflect.engine()
 
 
 @register.filter
@@ -23,9 +22,16 @@ def json_dumps(data):
     return mark_safe(json.dumps(data, separators=(',', ':')))
 
 
+@lru_cache(maxsize=None)
+def get_inflect_engine():
+    # NOTE: slow to import and to build, so wait for the first template using it
+    import inflect
+    return inflect.engine()
+
+
 @register.filter
 def inflect(value, func, *args):
-    return getattr(p, func)(value, *args)
+    return getattr(get_inflect_engine(), func)(value, *args)
 
 
 # https://stackoverflow.com/a/52749486
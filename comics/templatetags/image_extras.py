@@ -3,6 +3,9 @@ from imagekit.registry import generator_registry
 from imagekit.templatetags.imagekit import parse_dimensions
 
 DEFAULT_THUMBNAIL_GENERATOR = 'imagekit:thumbnail'
+COVER_GENERATOR = 'comics:cover'
+# display width of a cover in the grids, followed by the high density variants
+COVER_WIDTHS = (180, 360, 540)
 
 
 def thumbgen(*args, source=None, **kwargs):
@@ -22,3 +25,26 @@ def thumbgen(*args, source=None, **kwargs):
 
 def thumburl(*args, **kwargs):
     return thumbgen(*args, **kwargs).url
+
+
+def cover_widths(image):
+    # never bother upscaling, but always offer at least the base rendition
+    widths = [w for w in COVER_WIDTHS if w <= image.image_width]
+    return widths or COVER_WIDTHS[:1]
+
+
+def covergen(image, width=COVER_WIDTHS[0]):
+    return thumbgen(COVER_GENERATOR, '{}x'.format(width), source=image.safe_file)
+
+
+def coverurl(image, width=COVER_WIDTHS[0]):
+    if not image:
+        return ''
+    return covergen(image, width).url
+
+
+def coversrcset(image):
+    if not image:
+        return ''
+    return ', '.join('{} {}x'.format(coverurl(image, w), w // COVER_WIDTHS[0])
+                     for w in cover_widths(image))
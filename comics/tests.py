@@ -1,3 +1,1156 @@
-from django.test import TestCase
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from PIL import Image
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, DatabaseError
+from django.db.migrations import Migration
+from django.db.models.signals import post_migrate
+from django.template import engines
+from django.utils.datastructures import MultiValueDict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from comics.admin import InstallmentAdminForm
+from comics.apps import set_sqlite_pragmas
+from comics.conditional import get_response_stats
+from comics.importers import convert_pdf, count_cbz_pages, parse_cbz
+from comics.jobs import claim_next_job, enqueue_import, run_import_job, PageWriter, ReimportWriter
+from comics.models import GenericImage, Series, Installment, Page, Thread, ThreadSequence, SearchEntry, ImportJobFile, \
+    SourceImage, ImportJob, DONE, FAILED, PENDING, RUNNING
+from comics.search import search_entries, rebuild_index
+from comics.storage import blob_name, clean_temp_dir, count_references, MediaTemporaryFile
+from comics.templatetags.image_extras import coverurl, coversrcset, covergen
+from comics.uploadhandler import UploadSniffer
+from metadata.models import Character, Persona, Appearance, Creator
+
+MEDIA_ROOT = tempfile.mkdtemp()
+MEDIA_TEMP_DIR = tempfile.mkdtemp()
+
+
+def make_image(name, size=(40, 30), color='black'):
+    buf = BytesIO()
+    Image.new('RGB', size, color).save(buf, 'PNG')
+    return SimpleUploadedFile(name, buf.getvalue(), 'image/png')
+
+
+def make_installment(series, number, num_pages=1):
+    installment = Installment.objects.create(series=series, number=number, ordinal=number)
+    for i in range(num_pages):
+        Page.objects.create(installment=installment,
+                            order=i,
+                            file=make_image('{:04d}.png'.format(i)),
+                            original_name='{:04d}.png'.format(i))
+    return installment
+
+
+def make_pdf(num_pages):
+    pdf = b'%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n'
+    kids = ' '.join('{} 0 R'.format(i) for i in range(3, 3 + num_pages))
+    pdf += '2 0 obj\n<< /Type /Pages /Kids [{}] /Count {} >>\nendobj\n'.format(kids, num_pages).encode()
+    for i in range(3, 3 + num_pages):
+        pdf += '{} 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 300] >>\nendobj\n'.format(i).encode()
+    return pdf + 'trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n0\n%%EOF\n'.format(3 + num_pages).encode()
+
+
+def run_on_commit():
+    # TestCase never commits, so run the file cleanup straight away
+    def on_commit(func, using=None):
+        func()
+    return mock.patch.multiple('django.db.transaction', on_commit=on_commit), \
+        mock.patch.multiple('django_cleanup.handlers', on_commit=on_commit)
+
+
+def count_storage_opens():
+    return mock.patch.object(FileSystemStorage, 'open', autospec=True, side_effect=FileSystemStorage.open)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_TEMP_DIR=MEDIA_TEMP_DIR)
+class MediaTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(MEDIA_TEMP_DIR, ignore_errors=True)
+
+
+class QueryCountTestCase(MediaTestCase):
+    def assertQueriesDoNotGrow(self, url, add_rows, **extra):
+        with CaptureQueriesContext(connection) as before:
+            self.assertEqual(self.client.get(url, **extra).status_code, 200)
+        add_rows()
+        with CaptureQueriesContext(connection) as after:
+            self.assertEqual(self.client.get(url, **extra).status_code, 200)
+        self.assertEqual(len(before), len(after),
+                         '\n'.join(q['sql'] for q in after.captured_queries))
+
+
+class GenericImageTests(MediaTestCase):
+    def test_default_box_is_stored(self):
+        image = GenericImage.objects.create(src=make_image('src.png'))
+        image.refresh_from_db()
+        self.assertEqual(image.box, (0, 0, 40, 30))
+
+    def test_explicit_box_is_kept(self):
+        image = GenericImage(src=make_image('src.png'))
+        image.box = (5, 5, 25, 25)
+        image.save()
+        image.refresh_from_db()
+        self.assertEqual(image.box, (5, 5, 25, 25))
+        self.assertEqual(image.safe_size, (20, 20))
+
+    def test_backfill(self):
+        fill_boxes = import_module('comics.migrations.0009_genericimage_box_backfill').fill_boxes
+        image = GenericImage.objects.create(src=make_image('src.png'))
+        GenericImage.objects.filter(pk=image.pk).update(x1=0, y1=0, x2=0, y2=0)
+        fill_boxes(apps, None)
+        image.refresh_from_db()
+        self.assertEqual(image.box, (0, 0, 40, 30))
+
+    def test_iteration_opens_no_files(self):
+        for i in range(3):
+            GenericImage.objects.create(src=make_image('src{}.png'.format(i)))
+
+        with count_storage_opens() as opened:
+            for image in GenericImage.objects.all():
+                self.assertIsNotNone(image.box)
+                self.assertIsNotNone(image.image_url)
+                self.assertEqual(image.image_width, 40)
+        self.assertEqual(opened.call_count, 0)
+
+
+class ListingQueryTests(QueryCountTestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Alpha', slug='alpha')
+        make_installment(self.series, 1)
+
+    def test_index(self):
+        def add_rows():
+            for n in range(2, 5):
+                make_installment(Series.objects.create(name='S{}'.format(n), slug='s{}'.format(n)), 1)
+        self.assertQueriesDoNotGrow('/comics/', add_rows)
+
+    def test_series_detail(self):
+        def add_rows():
+            for n in range(2, 5):
+                make_installment(self.series, n)
+        self.assertQueriesDoNotGrow(self.series.get_absolute_url(), add_rows)
+
+    def test_series_covers(self):
+        make_installment(self.series, 2)
+        with self.assertNumQueries(3):
+            series = list(Series.objects.with_cover())
+            self.assertEqual(series[0].first_cover.order, 0)
+        with self.assertNumQueries(3):
+            series = list(Series.objects.with_cover(latest=True))
+            self.assertEqual(series[0].latest_cover.installment.number, 2)
+
+
+class InstallmentJSONTests(QueryCountTestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Alpha', slug='alpha')
+        self.installment = make_installment(self.series, 1)
+        self.add_appearances(self.installment.pages.get())
+
+    def add_appearances(self, page):
+        for name in ('Hero', 'Villain'):
+            persona = Persona.objects.create(character=Character.objects.create(), name=name)
+            Appearance.objects.create(persona=persona, installment=self.installment, page=page)
+
+    def add_pages(self):
+        for i in range(1, 4):
+            page = Page.objects.create(installment=self.installment,
+                                       order=i,
+                                       file=make_image('{:04d}.png'.format(i)))
+            self.add_appearances(page)
+
+    def test_installment_json(self):
+        url = self.installment.get_absolute_url()
+        self.assertQueriesDoNotGrow(url, self.add_pages, HTTP_ACCEPT='application/json')
+
+        with count_storage_opens() as opened:
+            data = self.client.get(url, HTTP_ACCEPT='application/json').json()
+        self.assertEqual(opened.call_count, 0)
+        pages = data['thread']['pages']
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(pages[3]['image_width'], 40)
+        self.assertEqual([a['persona']['name'] for a in pages[3]['appearances']], ['Hero', 'Villain'])
+
+
+class ManifestTests(MediaTestCase):
+    def setUp(self):
+        series = Series.objects.create(name='Alpha', slug='alpha')
+        self.installment = make_installment(series, 1, num_pages=3)
+        self.url = self.installment.get_absolute_url() + 'manifest'
+
+    def test_manifest(self):
+        # the two stamps, then the series, installment and pages
+        with count_storage_opens() as opened, self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        self.assertEqual(opened.call_count, 0)
+
+        data = response.json()
+        self.assertEqual(data['width'], [40, 40, 40])
+        self.assertEqual(data['height'], [30, 30, 30])
+        self.assertEqual(data['files'], {})
+        for i, page in enumerate(self.installment.pages.all()):
+            self.assertEqual(page.file.url, '{}{:04d}{}'.format(data['prefix'], i, data['ext']))
+
+    def test_revalidation(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        # from the stamps alone, without building the manifest
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        page = self.installment.pages.last()
+        page.file.save('other.png', make_image('other.png', (20, 20)))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['files'], {'2': page.file.url})
+
+        etag = response['ETag']
+        page.delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(CONTENT_ADDRESSED_PAGES=True)
+    def test_blobs(self):
+        installment = make_installment(self.installment.series, 2, num_pages=3)
+        page = installment.pages.last()
+        page.file.save('other.gif', make_image('other.gif', (20, 20)))
+
+        data = self.client.get(installment.get_absolute_url() + 'manifest').json()
+        # only the odd one out is spelled out
+        self.assertEqual(data['files'], {'2': page.file.url})
+        self.assertEqual(len(data['hashes']), 3)
+        for i, page in enumerate(installment.pages.all()[:2]):
+            sha256 = data['hashes'][i]
+            self.assertEqual(page.file.url, '{}{}/{}/{}{}'.format(
+                data['blob_prefix'], sha256[:2], sha256[2:4], sha256, data['ext']))
+
+
+class ConditionalGetTests(MediaTestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Alpha', slug='alpha')
+        self.installment = make_installment(self.series, 1)
+
+    def assertRevalidates(self, url, change, **extra):
+        etag = self.client.get(url, **extra)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **extra)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(queries), 4)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_page_bumps_series(self):
+        self.assertRevalidates(self.series.get_absolute_url(),
+                               lambda: make_installment(self.series, 2))
+
+    def test_page_bumps_installment(self):
+        page = self.installment.pages.get()
+        self.assertRevalidates(self.installment.get_absolute_url(),
+                               lambda: page.file.save('other.png', make_image('other.png')),
+                               HTTP_ACCEPT='application/json')
+
+    def test_label_bumps_listings(self):
+        label = self.series.installment_label
+
+        for i, url in enumerate(['/comics/', self.series.get_absolute_url(), self.installment.get_absolute_url()]):
+            label.value = 'part {}'.format(i)
+            with self.subTest(url=url):
+                self.assertRevalidates(url, label.save)
+
+    def test_response_cache(self):
+        url = self.series.get_absolute_url()
+        cache.clear()
+
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertLessEqual(len(queries), 2)
+        self.assertIn(b'Alpha', response.content)
+
+        make_installment(self.series, 2)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+        self.assertIn(('series_detail', 1, 2), get_response_stats())
+
+    def test_accept_varies(self):
+        url = self.installment.get_absolute_url()
+        response = self.client.get(url)
+        self.assertIn('Accept', response['Vary'])
+        self.assertNotEqual(response['ETag'], self.client.get(url, HTTP_ACCEPT='application/json')['ETag'])
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.series = Series.objects.create(name='<Alpha>', slug='alpha')
+        self.template = engines['jinja2'].from_string(
+            "{% cache 'test', series, installments %}{{ series.name }} {{ render() }}{% endcache %}")
+        self.renders = 0
+
+    def render(self):
+        def count():
+            self.renders += 1
+            return self.renders
+        return self.template.render({'series': self.series,
+                                     'installments': self.series.installments.all(),
+                                     'render': count})
+
+    def test_cache(self):
+        self.assertEqual(self.render(), '&lt;Alpha&gt; 1')
+        self.assertEqual(self.render(), '&lt;Alpha&gt; 1')
+
+        # new row in the queryset dependency, and then the bumped Series itself
+        Installment.objects.create(series=self.series, ordinal=1)
+        self.assertEqual(self.render(), '&lt;Alpha&gt; 2')
+        self.series.refresh_from_db()
+        self.assertEqual(self.render(), '&lt;Alpha&gt; 3')
+        self.assertEqual(self.render(), '&lt;Alpha&gt; 3')
+
+
+class NeighborTests(TestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Alpha', slug='alpha')
+        other = Series.objects.create(name='Beta', slug='beta')
+        Installment.objects.create(series=other, number=1, ordinal=1)
+        # the middle one is unnumbered, so it's addressed by its ordinal
+        self.installments = [
+            Installment.objects.create(series=self.series, number=number, ordinal=ordinal)
+            for number, ordinal in ((1, 1), (None, 2), (Decimal('2.5'), 3))
+        ]
+
+    def test_with_neighbors(self):
+        first, middle, last = self.installments
+        rows = Installment.objects \
+            .filter(series=self.series) \
+            .with_neighbors() \
+            .order_by('ordinal') \
+            .values_list('pk', 'prev_id', 'prev_number', 'prev_ordinal', 'next_id', 'next_number', 'next_ordinal')
+        self.assertEqual(list(rows), [
+            (first.pk, None, None, None, middle.pk, None, 2),
+            (middle.pk, first.pk, 1, 1, last.pk, Decimal('2.5'), 3),
+            (last.pk, middle.pk, None, 2, None, None, None),
+        ])
+
+    def test_load_neighbors(self):
+        first, middle, last = self.installments
+        with self.assertNumQueries(1):
+            middle = Installment.objects.get(pk=middle.pk)
+        # one query for both sides, filtered down to the one row in SQL
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(middle.prev_id, first.pk)
+            self.assertEqual(middle.next_id, last.pk)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('windowed', queries[0]['sql'])
+
+        series = self.series.get_url_kwargs()
+        self.assertEqual(middle.prev_url_kwargs, dict(series, number=1))
+        self.assertEqual(middle.next_url_kwargs, dict(series, number=Decimal('2.5')))
+        self.assertEqual(Installment.objects.get(pk=first.pk).next_url_kwargs, dict(series, ordinal=2))
+
+        first = Installment.objects.get(pk=first.pk)
+        self.assertIsNone(first.prev_id)
+        self.assertIsNone(first.prev_url_kwargs)
+        last = Installment.objects.get(pk=last.pk)
+        self.assertIsNone(last.next_id)
+        self.assertIsNone(last.next_url_kwargs)
+
+    def test_links(self):
+        first, middle, last = self.installments
+        html = self.client.get(middle.get_absolute_url()).content.decode()
+        self.assertIn('href="{}"'.format(first.get_absolute_url()), html)
+        self.assertIn('href="{}"'.format(last.get_absolute_url()), html)
+        self.assertEqual(Installment.objects.none().neighbors_of(middle.pk), {})
+
+
+class ThreadTests(QueryCountTestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Alpha', slug='alpha')
+        self.thread = Thread.objects.create(name='Crossover')
+        self.add_sequence(1, 1, end_page=2)
+
+    def add_sequence(self, number, begin_page=0, end_page=None):
+        installment = make_installment(self.series, number, num_pages=4)
+        return ThreadSequence.objects.create(thread=self.thread,
+                                             installment=installment,
+                                             begin_page=begin_page,
+                                             end_page=end_page,
+                                             order=self.thread.threadsequence_set.count())
+
+    def add_more_sequences(self):
+        for n in range(2, 5):
+            self.add_sequence(n)
+
+    def test_pages_follow_sequences(self):
+        self.add_sequence(2, 2)
+        # the same Installment twice, with its own range each time
+        ThreadSequence.objects.create(thread=self.thread,
+                                      installment=self.series.installments.get(number=1),
+                                      begin_page=0, end_page=0, order=2)
+
+        with self.assertNumQueries(1):
+            pages = [(p.installment_id, p.order) for p in self.thread.pages]
+        first, second = self.series.installments.order_by('number').values_list('pk', flat=True)
+        self.assertEqual(pages, [(first, 1), (first, 2), (second, 2), (second, 3), (first, 0)])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.thread.cover.order, 1)
+
+    def test_thread_detail(self):
+        self.assertQueriesDoNotGrow(self.thread.get_absolute_url(), self.add_more_sequences)
+
+
+class StartupTests(SimpleTestCase):
+    def test_heavy_imports_are_lazy(self):
+        # runs a fresh interpreter, as this one has long since imported everything
+        with mock.patch.dict(os.environ, DJANGO_JINJA2_CACHE_DIR=''):
+            call_command('benchmark_imports', '--check', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+class SQLitePragmaTests(TestCase):
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -4096, 'busy_timeout': 1234})
+    def test_pragmas_are_set(self):
+        set_sqlite_pragmas(sender=connection.__class__, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -4096)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Moonlight Patrol', slug='moonlight')
+        Installment.objects.create(series=self.series, number=1, ordinal=1, title='Dark Harbor',
+                                   synopsis='The patrol meets a lighthouse keeper.')
+        self.character = Character.objects.create()
+        persona = Persona.objects.create(character=self.character, name='Captain Lumen')
+        self.character.primary_persona = persona
+        self.character.save()
+
+    def search(self, query, **kwargs):
+        return [(e.kind, e.title) for e in search_entries(query, **kwargs)]
+
+    def test_ranked_prefix_search(self):
+        self.assertEqual(self.search('moon'), [('series', 'Moonlight Patrol'),
+                                               ('installment', 'Moonlight Patrol #1 — Dark Harbor')])
+        # title matches outrank synopsis ones
+        self.assertEqual(self.search('patrol')[0][0], 'series')
+        self.assertEqual(self.search('lighthouse'), [('installment', 'Moonlight Patrol #1 — Dark Harbor')])
+        self.assertEqual(self.search('dark" *'), [('installment', 'Moonlight Patrol #1 — Dark Harbor')])
+        self.assertEqual(self.search('moon', kinds=['series']), [('series', 'Moonlight Patrol')])
+
+    def test_signals_keep_index_current(self):
+        self.series.name = 'Sunlight Patrol'
+        self.series.save()
+        self.assertEqual(self.search('sunlight'), [('series', 'Sunlight Patrol'),
+                                                   ('installment', 'Sunlight Patrol #1 — Dark Harbor')])
+
+        persona = Persona.objects.create(character=self.character, name='The Beacon')
+        self.assertEqual(self.search('beacon'), [('character', 'Captain Lumen')])
+        creator = Creator.objects.create(working_name='Ada Inkwell')
+        persona.creators.add(creator)
+        self.assertEqual(self.search('inkwell'), [('creator', 'Ada Inkwell'), ('character', 'Captain Lumen')])
+        creator.delete()
+        self.assertEqual(self.search('inkwell'), [])
+
+        self.character.delete()
+        self.assertEqual(self.search('lumen'), [])
+
+    def test_label_reindexes_installments(self):
+        label = self.series.installment_label
+        label.value = 'episode'
+        label.save()
+        self.assertEqual(self.search('episode'), [('installment', 'Moonlight Patrol Episode 1 — Dark Harbor')])
+
+    def test_rebuild(self):
+        SearchEntry.objects.all().delete()
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(len(self.search('lumen')), 1)
+
+    def test_filled_on_migrate(self):
+        def migrate(name):
+            post_migrate.send(sender=apps.get_app_config('comics'), app_config=apps.get_app_config('comics'),
+                              verbosity=0, interactive=False, using='default', apps=apps,
+                              plan=[(Migration(name, 'comics'), False)])
+
+        SearchEntry.objects.all().delete()
+        migrate('0007_sourceimage_sha256')
+        self.assertFalse(SearchEntry.objects.exists())
+        migrate('0006_searchentry')
+        self.assertEqual(SearchEntry.objects.count(), 3)
+
+    def test_views(self):
+        response = self.client.get('/search', {'q': 'lumen'})
+        self.assertContains(response, 'href="{}"'.format(self.character.get_absolute_url()))
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get('/admin/comics/series/', {'q': 'moon'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.series])
+
+
+class QueueTests(MediaTestCase):
+    def setUp(self):
+        # the worker would close the connection, and the test's transaction with it
+        patcher = mock.patch('comics.management.commands.import_worker.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'),
+                                                      ordinal=1)
+
+    def enqueue(self, files):
+        return enqueue_import(self.installment, files, total_pages=len(files))
+
+    def test_worker(self):
+        files = [make_image('{:04d}.png'.format(i), (40 + i, 30)) for i in range(3)]
+        job = self.enqueue(files)
+        staged = [jf.file.path for jf in job.files.all()]
+
+        transaction_patch, cleanup_patch = run_on_commit()
+        with transaction_patch, cleanup_patch:
+            call_command('import_worker', '--once', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, DONE, job.error)
+        self.assertEqual(job.done_pages, 3)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual([(p.order, p.file_width) for p in self.installment.pages.all()],
+                         [(i, 40 + i) for i in range(3)])
+        self.assertFalse(job.files.exists())
+        self.assertFalse(any(os.path.exists(path) for path in staged))
+
+    def test_claim_once(self):
+        job = self.enqueue([make_image('0000.png')])
+        self.assertEqual(claim_next_job(), job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RUNNING)
+        self.assertIsNotNone(job.started_at)
+        self.assertIsNone(claim_next_job())
+
+        # another worker that listed it as pending just before doesn't get it either
+        filter_jobs = ImportJob.objects.filter
+
+        def stale_listing(**kwargs):
+            if kwargs == {'status': PENDING}:
+                return mock.Mock(order_by=lambda *fields: [job])
+            return filter_jobs(**kwargs)
+
+        with mock.patch.object(ImportJob.objects, 'filter', side_effect=stale_listing):
+            self.assertIsNone(claim_next_job())
+
+    def test_requeue(self):
+        job = self.enqueue([make_image('0000.png')])
+        ImportJob.objects.filter(pk=job.pk).update(status=RUNNING, done_pages=1)
+
+        out = StringIO()
+        # requeued, then claimed and run again
+        with mock.patch('comics.management.commands.import_worker.run_import_job') as run:
+            call_command('import_worker', '--once', '--requeue', stdout=out)
+        self.assertIn('Requeued 1 job(s).', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done_pages), (RUNNING, 0))
+        self.assertEqual(run.call_args[0][0], job)
+
+    def test_unreadable_file(self):
+        job = self.enqueue([SimpleUploadedFile('0000.png', b'not an image', 'image/png')])
+        call_command('import_worker', '--once', stdout=StringIO(), stderr=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, FAILED)
+        self.assertIn('unreadable image', job.error)
+        self.assertFalse(self.installment.pages.exists())
+
+
+class ImportTests(MediaTestCase):
+    def test_bulk_pages(self):
+        series = Series.objects.create(name='Alpha', slug='alpha')
+        installment = Installment.objects.create(series=series, ordinal=1)
+        stamp = Installment.objects.get(pk=installment.pk).updated_at
+        files = [make_image('{:04d}.png'.format(i), (40 + i, 30)) for i in range(5)]
+        job = enqueue_import(installment, files, total_pages=len(files))
+
+        with count_storage_opens() as opened:
+            run_import_job(job, batch_size=2)
+        # just the staged uploads, and nothing read back for dimensions
+        self.assertEqual(opened.call_count, len(files))
+        self.assertEqual(job.status, DONE, job.error)
+        self.assertEqual(job.done_pages, 5)
+
+        installment.refresh_from_db()
+        self.assertEqual(installment.page_count, 5)
+        self.assertGreater(installment.updated_at, stamp)
+        pages = list(installment.pages.all())
+        self.assertEqual([(p.order, p.file_width, p.file_height) for p in pages],
+                         [(i, 40 + i, 30) for i in range(5)])
+        self.assertEqual([p.original_name for p in pages], ['{:04d}.png'.format(i) for i in range(5)])
+        self.assertTrue(all(p.file.storage.exists(p.file.name) for p in pages))
+
+    def test_staged_pages_are_linked(self):
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'), ordinal=1)
+        files = [make_image('{:04d}.png'.format(i), (40 + i, 30)) for i in range(3)]
+        job = enqueue_import(installment, files, total_pages=len(files))
+        staged = {os.stat(jf.file.path).st_ino for jf in job.files.all()}
+
+        with mock.patch('comics.storage.os.link', side_effect=OSError(errno.EXDEV, 'cross-device link')):
+            run_import_job(job)
+        page = installment.pages.first()
+        self.assertNotIn(os.stat(page.file.path).st_ino, staged)
+        self.assertEqual((page.file_width, page.file_height), (40, 30))
+
+        installment = Installment.objects.create(series=installment.series, ordinal=2)
+        files = [make_image('{:04d}.png'.format(i), (50 + i, 30)) for i in range(3)]
+        job = enqueue_import(installment, files, total_pages=len(files))
+        staged = {os.stat(jf.file.path).st_ino for jf in job.files.all()}
+        run_import_job(job)
+        self.assertEqual({os.stat(page.file.path).st_ino for page in installment.pages.all()}, staged)
+
+    def test_temporary_files_are_moved(self):
+        file = MediaTemporaryFile('page.png', 'image/png', 0, None)
+        file.write(make_image('page.png').read())
+        file.flush()
+        path = file.temporary_file_path()
+        # where it can't be served
+        self.assertEqual(os.path.dirname(path), MEDIA_TEMP_DIR)
+        self.assertFalse(path.startswith(default_storage.path('')))
+        inode = os.stat(path).st_ino
+
+        name = default_storage.save('moved/page.png', file)
+        file.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.stat(default_storage.path(name)).st_ino, inode)
+
+    def test_clean_temp_dir(self):
+        stale = MediaTemporaryFile('stale.png', 'image/png', 0, None)
+        fresh = MediaTemporaryFile('fresh.png', 'image/png', 0, None)
+        self.addCleanup(fresh.close)
+        day_ago = time.time() - 25 * 60 * 60
+        os.utime(stale.temporary_file_path(), (day_ago, day_ago))
+
+        out = StringIO()
+        call_command('clean_media_temp', stdout=out)
+        self.assertIn('removed 1 stale file(s)', out.getvalue())
+        self.assertFalse(os.path.exists(stale.temporary_file_path()))
+        self.assertTrue(os.path.exists(fresh.temporary_file_path()))
+        # its owner closing it afterwards is no problem
+        stale.close()
+
+    @override_settings(FILE_UPLOAD_DIRECTORY_PERMISSIONS=0o750)
+    def test_directory_permissions(self):
+        file = MediaTemporaryFile('page.png', 'image/png', 0, None)
+        file.write(make_image('page.png').read())
+        file.flush()
+        name = default_storage.save('perms/nested/page.png', file)
+        file.close()
+        for directory in ('perms', 'perms/nested'):
+            self.assertEqual(os.stat(default_storage.path(directory)).st_mode & 0o777, 0o750)
+
+        name, _, pin = default_storage.save_blob(make_image('other.png', color='white'), '.png')
+        default_storage.release_blob(name, pin)
+        self.assertEqual(os.stat(os.path.dirname(default_storage.path(name))).st_mode & 0o777, 0o750)
+        self.assertFalse(os.path.exists(pin))
+
+    def import_pages(self, installment, colors):
+        files = [make_image('{:04d}.png'.format(i), color=color) for i, color in enumerate(colors)]
+        job = run_import_job(enqueue_import(installment, files, total_pages=len(files)))
+        self.assertEqual(job.status, DONE, job.error)
+        installment.refresh_from_db()
+        self.assertEqual(installment.page_count, len(colors))
+        return list(installment.pages.all())
+
+    def test_reimport(self):
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'), ordinal=1)
+        a, b, c, d = self.import_pages(installment, ['red', 'green', 'blue', 'white'])
+        persona = Persona.objects.create(character=Character.objects.create(), name='Hero')
+        for page in (b, c):
+            Appearance.objects.create(persona=persona, installment=installment, page=page)
+
+        # one page rescanned, another inserted up front, and the last dropped
+        transaction_patch, cleanup_patch = run_on_commit()
+        with transaction_patch, cleanup_patch:
+            pages = self.import_pages(installment, ['black', 'red', 'yellow', 'blue'])
+        self.assertEqual([p.pk for p in pages[1:]], [a.pk, b.pk, c.pk])
+        self.assertEqual([p.order for p in pages], [0, 1, 2, 3])
+        self.assertEqual([p.file.name for p in (pages[1], pages[3])], [a.file.name, c.file.name])
+        self.assertNotEqual(pages[2].file.name, b.file.name)
+        self.assertFalse(b.file.storage.exists(b.file.name))
+        self.assertFalse(d.file.storage.exists(d.file.name))
+        self.assertEqual(Appearance.objects.filter(installment=installment).count(), 2)
+
+    def list_media(self):
+        return {os.path.relpath(os.path.join(dirpath, filename), default_storage.path(''))
+                for dirpath, _, filenames in os.walk(default_storage.path('')) for filename in filenames}
+
+    def test_reimport_in_batches(self):
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'), ordinal=1)
+        a, b, c, d = self.import_pages(installment, ['red', 'green', 'blue', 'white'])
+        files = [make_image('{:04d}.png'.format(i), color=color)
+                 for i, color in enumerate(['black', 'red', 'yellow', 'blue', 'gray', 'navy', 'pink'])]
+        job = enqueue_import(installment, files, total_pages=len(files))
+
+        batches = []
+        insert_pages = PageWriter.insert_pages
+
+        def record_batch(pages):
+            batches.append(len(pages))
+            insert_pages(pages)
+
+        with mock.patch.object(PageWriter, 'insert_pages', staticmethod(record_batch)):
+            job = run_import_job(job, batch_size=2)
+        self.assertEqual(job.status, DONE, job.error)
+        self.assertEqual(batches, [2, 1])
+        installment.refresh_from_db()
+        self.assertEqual(installment.page_count, 7)
+        pages = list(installment.pages.all())
+        self.assertEqual([p.pk for p in pages[1:5]], [a.pk, b.pk, c.pk, d.pk])
+        self.assertEqual([p.order for p in pages], list(range(7)))
+
+    def test_reimport_leaves_no_files(self):
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'), ordinal=1)
+        self.import_pages(installment, ['red', 'green'])
+        files = [make_image('{:04d}.png'.format(i), color=color)
+                 for i, color in enumerate(['red', 'blue', 'white', 'black', 'gray'])]
+        job = enqueue_import(installment, files, total_pages=len(files))
+        media, temp = self.list_media(), set(os.listdir(MEDIA_TEMP_DIR))
+
+        # nothing goes into storage before it's written, so a crash leaves
+        # only temporary files behind
+        writer = ReimportWriter(job, batch_size=1)
+        with job.files.get(original_name='0001.png').file.open('rb') as fp:
+            writer.add(1, File(fp, name='0001.png'))
+        self.assertEqual(self.list_media(), media)
+        self.assertEqual(len(set(os.listdir(MEDIA_TEMP_DIR)) - temp), 1)
+        writer.discard()
+        self.assertEqual(set(os.listdir(MEDIA_TEMP_DIR)), temp)
+
+        # and a failed batch leaves none that aren't in use
+        insert_pages = PageWriter.insert_pages
+
+        def fail_second_batch(pages):
+            if any(page.original_name == '0004.png' for page in pages):
+                raise DatabaseError('connection lost')
+            insert_pages(pages)
+
+        transaction_patch, cleanup_patch = run_on_commit()
+        with transaction_patch, cleanup_patch, \
+                mock.patch.object(PageWriter, 'insert_pages', staticmethod(fail_second_batch)):
+            job = run_import_job(job, batch_size=1)
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(installment.pages.count(), 4)
+        in_use = set(SourceImage.objects.values_list('file', flat=True))
+        self.assertLessEqual(self.list_media() - media, in_use)
+        self.assertEqual(set(os.listdir(MEDIA_TEMP_DIR)), temp)
+
+
+@override_settings(CONTENT_ADDRESSED_PAGES=True)
+class ContentAddressedTests(ImportTests):
+    def test_shared_blobs(self):
+        # a media tree of its own, for the report
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        own_media = override_settings(MEDIA_ROOT=media_root)
+        own_media.enable()
+        self.addCleanup(own_media.disable)
+
+        series = Series.objects.create(name='Alpha', slug='alpha')
+        first = Installment.objects.create(series=series, ordinal=1)
+        second = Installment.objects.create(series=series, ordinal=2)
+        pages = self.import_pages(first, ['red', 'green', 'red'])
+        pages += self.import_pages(second, ['green', 'blue'])
+        names = [page.file.name for page in pages]
+        self.assertEqual(len(set(names)), 3)
+        self.assertEqual(names[0], names[2])
+        self.assertEqual(names[1], names[3])
+        for page in pages:
+            self.assertEqual(page.file.name, blob_name(page.sha256, '.png'))
+            self.assertTrue(page.file.storage.exists(page.file.name))
+
+        # saved the usual way, rather than imported
+        page = Page.objects.create(installment=second, order=2, file=make_image('extra.png', color='blue'))
+        self.assertEqual(page.file.name, names[4])
+
+        out = StringIO()
+        call_command('dedupe_report', stdout=out)
+        self.assertIn('3 blob(s)', out.getvalue())
+        self.assertIn('referenced 6 time(s)', out.getvalue())
+
+        storage = pages[0].file.storage
+        transaction_patch, cleanup_patch = run_on_commit()
+        with transaction_patch, cleanup_patch:
+            first.delete()
+            # still used by the second Installment
+            self.assertFalse(storage.exists(names[0]))
+            self.assertTrue(storage.exists(names[1]))
+            second.delete()
+            self.assertFalse(storage.exists(names[1]))
+            self.assertFalse(storage.exists(names[4]))
+
+
+@override_settings(CONTENT_ADDRESSED_PAGES=True)
+class BlobRaceTests(MediaTestCase):
+    def setUp(self):
+        series = Series.objects.create(name='Alpha', slug='alpha')
+        self.installment = make_installment(series, 1)
+        self.page = self.installment.pages.get()
+        self.storage = self.page.file.storage
+        self.name = self.page.file.name
+
+    def test_delete_before_insert_commits(self):
+        # the insert finds the blob there, then the last other user goes
+        name, sha256, pin = self.storage.save_blob(make_image('0000.png'), '.png')
+        self.assertEqual(name, self.name)
+        self.page.delete()
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+        # once its row is in, the blob is put back from the pin
+        Page.objects.create(installment=self.installment, order=1, file=name, sha256=sha256,
+                            file_width=40, file_height=30)
+        self.storage.release_blob(name, pin)
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(os.path.exists(pin))
+        with self.storage.open(name) as fp:
+            self.assertEqual(fp.read(), make_image('0000.png').read())
+
+    def test_insert_commits_during_delete(self):
+        # counted before the other row was committed, and again after
+        counts = iter([{}])
+        with mock.patch('comics.storage.count_references',
+                        side_effect=lambda names: next(counts, None) or count_references(names)):
+            self.storage.delete(self.name)
+        self.assertTrue(self.storage.exists(self.name))
+
+    def test_pin_of_old_blob_is_fresh(self):
+        # clean_media_temp mustn't take it for a leftover
+        day_ago = time.time() - 25 * 60 * 60
+        os.utime(self.storage.path(self.name), (day_ago, day_ago))
+        _, _, pin = self.storage.save_blob(make_image('0000.png'), '.png', self.page.sha256)
+        self.addCleanup(self.storage.release_blob, self.name, pin)
+        self.assertEqual(clean_temp_dir(24 * 60 * 60), [])
+        self.assertTrue(os.path.exists(pin))
+
+    def test_page_save_releases_pin(self):
+        pins = set(os.listdir(MEDIA_TEMP_DIR))
+        transaction_patch, cleanup_patch = run_on_commit()
+        with transaction_patch, cleanup_patch:
+            page = Page.objects.create(installment=self.installment, order=1, file=make_image('0001.png'))
+        self.assertFalse(hasattr(page, '_blob_pin'))
+        self.assertEqual(set(os.listdir(MEDIA_TEMP_DIR)), pins)
+
+
+class UploadTests(MediaTestCase):
+    def sniff_pdf(self, pdf, chunk_size=64):
+        sniffer = UploadSniffer()
+        for start in range(0, len(pdf), chunk_size):
+            sniffer.feed(pdf[start:start + chunk_size], start)
+        return sniffer.sniffed()
+
+    def test_sniffer(self):
+        image = make_image('page.png', (123, 45)).read()
+        sniffer = UploadSniffer()
+        for start in range(0, len(image), 16):
+            sniffer.feed(image[start:start + 16], start)
+        self.assertEqual(sniffer.sniffed(), {
+            'sha256': hashlib.sha256(image).hexdigest(),
+            'content_kind': 'image',
+            'image_size': (123, 45),
+        })
+
+        pdf = make_pdf(3)
+        self.assertEqual(self.sniff_pdf(pdf)['content_kind'], 'pdf')
+        self.assertEqual(self.sniff_pdf(pdf)['page_count'], 3)
+
+    def test_sniffer_incremental_pdf(self):
+        # an update that drops three of the five pages, leaving the old tree
+        # behind in the file; then one whose new root isn't the largest count
+        pdf = make_pdf(5)
+        pdf += b'2 0 obj\n<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >>\nendobj\n' \
+               b'trailer\n<< /Size 8 /Root 1 0 R /Prev 9 >>\nstartxref\n0\n%%EOF\n'
+        self.assertEqual(self.sniff_pdf(pdf)['page_count'], 2)
+        self.assertEqual(self.sniff_pdf(pdf, chunk_size=7)['page_count'], 2)
+
+        pdf += b'8 0 obj\n<< /Type /Catalog /Pages 9 0 R /Outlines << /Count 40 >> >>\nendobj\n' \
+               b'9 0 obj\n<< /Count 1 /Kids [3 0 R] /Type /Pages >>\nendobj\n' \
+               b'trailer\n<< /Size 10 /Root 8 0 R /Prev 99 >>\nstartxref\n0\n%%EOF\n'
+        self.assertEqual(self.sniff_pdf(pdf)['page_count'], 1)
+
+        # a catalog in a compressed object stream can't be read this way
+        self.assertNotIn('page_count', self.sniff_pdf(pdf.replace(b'/Root 8 0 R', b'/Root 10 0 R')))
+
+    def test_admin_upload(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'),
+                                                 number=1, ordinal=1)
+        url = '/admin/comics/installment/{}/change/'.format(installment.pk)
+        self.client.login(username='admin', password='password')
+        data = {'series': installment.series_id, 'number': '1'}
+        for inline in self.client.get(url).context['inline_admin_formsets']:
+            data.update({'{}-{}'.format(inline.formset.prefix, name): '0'
+                         for name in ('TOTAL_FORMS', 'INITIAL_FORMS', 'MIN_NUM_FORMS', 'MAX_NUM_FORMS')})
+
+        # exempt from the middleware, but not from the check itself
+        client = self.client_class(enforce_csrf_checks=True)
+        client.login(username='admin', password='password')
+        self.assertEqual(client.post(url, data).status_code, 403)
+
+        response = self.client.post(url, dict(data, page_files=[
+            make_image('0001.png', (60, 90), 'red'),
+            SimpleUploadedFile('0002.png', b'not an image', 'image/png'),
+        ]))
+        self.assertContains(response, '0002.png is not an image.')
+
+        image = make_image('0001.png', (60, 90), 'red')
+        response = self.client.post(url, dict(data, page_files=[image]))
+        self.assertEqual(response.status_code, 302)
+        jf = ImportJobFile.objects.get()
+        image.seek(0)
+        self.assertEqual(jf.sha256, hashlib.sha256(image.read()).hexdigest())
+        self.assertEqual((jf.image_width, jf.image_height), (60, 90))
+
+        # the import goes by what the upload handler saw, without reading any of it again
+        with mock.patch('comics.jobs.get_image_dimensions') as get_dimensions, \
+                mock.patch('comics.jobs.file_sha256') as hash_file:
+            job = run_import_job(jf.job)
+        self.assertEqual(job.status, DONE, job.error)
+        self.assertFalse(get_dimensions.called)
+        self.assertFalse(hash_file.called)
+        page = installment.pages.get()
+        self.assertEqual((page.file_width, page.file_height, page.sha256), (60, 90, jf.sha256))
+
+
+def make_cbz(members):
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return SimpleUploadedFile('book.cbz', buf.getvalue(), 'application/zip')
+
+
+class ArchiveTests(MediaTestCase):
+    def setUp(self):
+        self.archive = make_cbz([
+            ('book/pages/page10.png', make_image('a', (41, 30)).read()),
+            ('book/pages/page2.png', make_image('b', (42, 30)).read()),
+            ('book/cover.png', make_image('c', (43, 30)).read()),
+            ('book/ComicInfo.xml', b'<ComicInfo/>'),
+            ('book/pages/', b''),
+            ('__MACOSX/book/._page2.png', b'junk'),
+            ('book/.page1.png', b'hidden'),
+        ])
+
+    def test_count_and_order(self):
+        self.assertEqual(count_cbz_pages(self.archive), 3)
+        names = [(i, file.name, file.size) for i, file in parse_cbz(self.archive)]
+        self.assertEqual([name for _, name, _ in names], ['cover.png', 'page2.png', 'page10.png'])
+        self.assertEqual([i for i, _, _ in names], [0, 1, 2])
+
+    def test_import(self):
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'),
+                                                 ordinal=1, archive=self.archive)
+        job = run_import_job(enqueue_import(installment, [installment.archive], total_pages=3))
+        self.assertEqual(job.status, DONE, job.error)
+        self.assertFalse(job.files.exists())
+        self.assertEqual([p.file_width for p in installment.pages.all()], [43, 42, 41])
+
+    def test_bad_archive(self):
+        with self.assertRaises(zipfile.BadZipFile):
+            count_cbz_pages(SimpleUploadedFile('book.cbz', b'not a zip'))
+
+        installment = Installment.objects.create(series=Series.objects.create(name='Alpha', slug='alpha'),
+                                                 ordinal=1)
+        form = InstallmentAdminForm(
+            data={'series': installment.series_id, 'number': '1'},
+            files=MultiValueDict({'page_files': [SimpleUploadedFile('book.cbz', b'not a zip')]}),
+            instance=installment)
+        self.assertFalse(form.is_valid())
+        self.assertIn('Not a valid CBZ / ZIP archive.', form.errors['page_files'])
+
+
+def can_load_pdfs():
+    try:
+        import pyvips
+    except (ImportError, OSError):
+        return False
+    return bool(pyvips.type_find('VipsForeign', 'pdfload'))
+
+
+@skipUnless(can_load_pdfs(), 'libvips without PDF support')
+class RasterTests(MediaTestCase):
+    def convert(self, num_pages):
+        pdf = SimpleUploadedFile('book.pdf', make_pdf(num_pages), 'application/pdf')
+        return convert_pdf(pdf, [{}] * num_pages, dpi=72, workers=1)
+
+    def test_convert_pdf(self):
+        pages = []
+        for i, file in self.convert(3):
+            pages.append((i, file.image_size, file.name))
+            self.assertTrue(os.path.exists(file.temporary_file_path()))
+        self.assertEqual(pages, [(i, (200, 300), 'book_{:04d}.png'.format(i)) for i in range(3)])
+
+    def test_abandoned(self):
+        # kept hold of, so they can't just be garbage collected away
+        made = []
+
+        def make_file(*args):
+            made.append(MediaTemporaryFile(*args))
+            return made[-1]
+
+        with mock.patch('comics.importers.MediaTemporaryFile', side_effect=make_file):
+            pages = self.convert(5)
+            i, file = next(pages)
+            self.assertEqual(i, 0)
+            # a window of pages is queued up behind the first
+            self.assertGreater(len(made), 1)
+            pages.close()
+        self.assertTrue(all(file.closed for file in made))
+        self.assertFalse(any(os.path.exists(file.file.name) for file in made))
+
+
+class DimensionTests(MediaTestCase):
+    def setUp(self):
+        self.installment = make_installment(Series.objects.create(name='Alpha', slug='alpha'), 1, num_pages=2)
+        self.pages = Page.objects.filter(installment=self.installment)
+
+    def test_stored_size(self):
+        page = self.pages.first()
+        with count_storage_opens() as opened:
+            self.assertEqual(page.safe_size, (40, 30))
+        self.assertEqual(opened.call_count, 0)
+
+    def test_missing_size_falls_back(self):
+        SourceImage.objects.filter(pk__in=self.pages.values('pk')).update(file_width=0, file_height=0)
+        page = self.pages.first()
+        with count_storage_opens() as opened:
+            self.assertEqual((page.image_width, page.image_height), (40, 30))
+        self.assertEqual(opened.call_count, 1)
+
+    def test_backfill(self):
+        SourceImage.objects.filter(pk__in=self.pages.values('pk')).update(file_width=0, file_height=0)
+        out = StringIO()
+        call_command('page_dimensions', stdout=out, stderr=StringIO())
+        self.assertIn('SourceImage: checked 2 file(s).', out.getvalue())
+        self.assertEqual(list(self.pages.values_list('file_width', 'file_height')), [(40, 30), (40, 30)])
+        call_command('page_dimensions', '--verify', stdout=StringIO())
+
+        SourceImage.objects.filter(pk=self.pages.first().pk).update(file_width=10)
+        with self.assertRaises(CommandError):
+            call_command('page_dimensions', '--verify', stdout=StringIO())
+        # only the empty ones, unless asked
+        call_command('page_dimensions', stdout=StringIO())
+        self.assertEqual(self.pages.first().file_width, 10)
+        call_command('page_dimensions', '--all', stdout=StringIO())
+        self.assertEqual(self.pages.first().file_width, 40)
+
+
+class CoverTests(MediaTestCase):
+    def setUp(self):
+        series = Series.objects.create(name='Alpha', slug='alpha')
+        self.installment = Installment.objects.create(series=series, number=1, ordinal=1, has_cover=True)
+        self.cover = Page.objects.create(installment=self.installment, order=0,
+                                         file=make_image('cover.png', (400, 600)))
+
+    def test_srcset(self):
+        srcset = coversrcset(self.cover)
+        self.assertEqual(srcset, '{} 1x, {} 2x'.format(coverurl(self.cover, 180), coverurl(self.cover, 360)))
+        self.assertEqual(coverurl(None), '')
+
+        small = Page.objects.create(installment=self.installment, order=1, file=make_image('small.png', (100, 150)))
+        self.assertEqual(coversrcset(small), '{} 1x'.format(coverurl(small)))
+
+    def test_generate_covers(self):
+        out = StringIO()
+        call_command('generate_covers', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '2 rendition(s) ready, 0 failed.')
+
+        rendition = covergen(self.cover, 360)
+        with rendition.storage.open(rendition.name) as fp, Image.open(fp) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (360, 540)))
+
+
+class CountTests(MediaTestCase):
+    def setUp(self):
+        self.series = Series.objects.create(name='Alpha', slug='alpha')
+        self.other_series = Series.objects.create(name='Beta', slug='beta')
+
+    def assertCounts(self, obj, field, expected):
+        obj.refresh_from_db(fields=[field])
+        self.assertEqual(getattr(obj, field), expected)
+
+    def test_installment_counts(self):
+        first = make_installment(self.series, 1, num_pages=2)
+        second = make_installment(self.series, 2)
+        self.assertCounts(self.series, 'installment_count', 2)
+        self.assertCounts(first, 'page_count', 2)
+
+        second.series = self.other_series
+        second.save()
+        self.assertCounts(self.series, 'installment_count', 1)
+        self.assertCounts(self.other_series, 'installment_count', 1)
+        # saving again without a move changes nothing
+        second.save()
+        self.assertCounts(self.other_series, 'installment_count', 1)
+
+        Installment.objects.get(pk=second.pk).delete()
+        self.assertCounts(self.other_series, 'installment_count', 0)
+
+    def test_page_counts(self):
+        first = make_installment(self.series, 1, num_pages=3)
+        second = make_installment(self.other_series, 1)
+        stamp = Series.objects.get(pk=self.other_series.pk).updated_at
+
+        page = Page.objects.filter(installment=first).last()
+        page.installment = second
+        page.save()
+        self.assertCounts(first, 'page_count', 2)
+        self.assertCounts(second, 'page_count', 2)
+        self.assertGreater(Series.objects.get(pk=self.other_series.pk).updated_at, stamp)
+
+        Page.objects.filter(installment=first).first().delete()
+        self.assertCounts(first, 'page_count', 1)
+        # cascades go through the signals one row at a time too
+        self.series.delete()
+        self.assertCounts(second, 'page_count', 2)
+
+    def test_bulk_import(self):
+        installment = make_installment(self.series, 1, num_pages=0)
+        files = [make_image('{:04d}.png'.format(i)) for i in range(1, 4)]
+        # PageWriter inserts without the signals, then counts once at the end
+        run_import_job(enqueue_import(installment, files, total_pages=len(files)), batch_size=2)
+        self.assertCounts(installment, 'page_count', 3)
+        self.assertCounts(self.series, 'installment_count', 1)
+
+    def test_recount(self):
+        installment = make_installment(self.series, 1, num_pages=2)
+        Installment.objects.filter(pk=installment.pk).update(page_count=7)
+        Series.objects.filter(pk=self.series.pk).update(installment_count=0)
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recount', '--verify', stdout=out)
+        self.assertIn('page_count is 7, should be 2', out.getvalue())
+
+        call_command('recount', stdout=StringIO())
+        self.assertCounts(installment, 'page_count', 2)
+        self.assertCounts(self.series, 'installment_count', 1)
+        call_command('recount', '--verify', stdout=StringIO())
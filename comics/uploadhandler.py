@@ -0,0 +1,246 @@
+import hashlib
+import re
+import struct
+import zlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+from comics.storage import MediaTemporaryFile
+from comics.validators import CBZ_EXTS
+
+# NOTE: what the sniffing upload handlers leave on each uploaded file, where
+#       they could work it out from the bytes going past:
+#         sha256       - hex digest of the whole file
+#         content_kind - 'image', 'pdf' or 'zip', from its leading bytes
+#         image_size   - (width, height), for images
+#         page_count   - for PDFs whose catalog and page tree root aren't
+#                        in a compressed object stream
+
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',
+    b'GIF87a', b'GIF89a',
+    b'BM',
+    b'II*\x00', b'MM\x00*',
+    b'\x00\x00\x00\x0cjP  \r\n\x87\n',
+    b'\xff\x4f\xff\x51',
+)
+ZIP_SIGNATURES = (
+    b'PK\x03\x04',
+    b'PK\x05\x06',
+)
+
+# enough for the headers of every image format PIL knows about
+IMAGE_SNIFF_LIMIT = 1024 * 1024
+# NOTE: a PDF's page count is the /Count of the page tree root, which is the
+#       /Pages of the catalog that the (last) trailer's /Root points at; an
+#       incremental update appends new versions of objects, so the last
+#       definition of each one wins. Only the dictionary at the head of each
+#       object or trailer is kept, never a stream's contents
+# NOTE: plain bytes.find() wherever it'll do, as it's many times quicker
+#       than a regex over the megabytes of image streams in between
+PDF_SECTION_END_WORDS = (b'endobj', b'stream', b'startxref')
+RE_PDF_OBJ_NUMBER = re.compile(rb'(\d+)\s+\d+\s+$')
+RE_PDF_ROOT = re.compile(rb'/Root\s+(\d+)\s+\d+\s+R\b')
+RE_PDF_TYPE = re.compile(rb'/Type\s*/(Catalog|Pages)\b')
+RE_PDF_PAGES_REF = re.compile(rb'/Pages\s+(\d+)\s+\d+\s+R\b')
+RE_PDF_COUNT = re.compile(rb'/Count\s+(\d+)')
+# longer than any header split across two chunks
+PDF_OVERLAP = 64
+PDF_HEAD_LIMIT = 64 * 1024
+
+CONTENT_KIND_LABELS = {
+    'image': 'an image',
+    'pdf': 'a PDF',
+    'zip': 'a CBZ / ZIP archive',
+}
+
+
+def ext_content_kind(ext):
+    if ext == 'pdf':
+        return 'pdf'
+    elif ext in CBZ_EXTS:
+        return 'zip'
+    return 'image'
+
+
+def get_content_kind(head):
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    elif head.startswith(ZIP_SIGNATURES):
+        return 'zip'
+    elif head.startswith(IMAGE_SIGNATURES):
+        return 'image'
+    return None
+
+
+class UploadSniffer(object):
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.kind = None
+        self.image_parser = None
+        self.image_size = None
+        self.image_bytes = 0
+        self.pdf_buffer = b''
+        self.pdf_section = None
+        self.pdf_root = None
+        self.pdf_catalogs = {}
+        self.pdf_page_trees = {}
+
+    def feed(self, data, start):
+        self.digest.update(data)
+        if start == 0:
+            self.kind = get_content_kind(data)
+            if self.kind == 'image':
+                from PIL import ImageFile
+                self.image_parser = ImageFile.Parser()
+
+        if self.image_parser is not None:
+            self.feed_image(data)
+        elif self.kind == 'pdf':
+            self.feed_pdf(data)
+
+    def feed_image(self, data):
+        # same as get_image_dimensions, only fed as the bytes arrive
+        try:
+            self.image_parser.feed(data)
+        except zlib.error as e:
+            if 'incomplete' not in str(e):
+                self.image_parser = None
+                return
+        except struct.error:
+            pass
+        self.image_bytes += len(data)
+        if self.image_parser.image:
+            self.image_size = self.image_parser.image.size
+            self.image_parser = None
+        elif self.image_bytes > IMAGE_SNIFF_LIMIT:
+            self.image_parser = None
+
+    def feed_pdf(self, data):
+        buffer = self.pdf_buffer + data
+        pos = 0
+        trailer_at = buffer.find(b'trailer')
+        while True:
+            if self.pdf_section is None:
+                if 0 <= trailer_at < pos:
+                    trailer_at = buffer.find(b'trailer', pos)
+                obj_at = buffer.find(b'obj', pos)
+                if obj_at < 0 and trailer_at < 0:
+                    pos = max(pos, len(buffer) - PDF_OVERLAP)
+                    break
+                if trailer_at >= 0 and (obj_at < 0 or trailer_at < obj_at):
+                    # a trailer is object 0, which no real object can be
+                    self.pdf_section = 0
+                    pos = trailer_at + len(b'trailer')
+                else:
+                    pos = obj_at + len(b'obj')
+                    # skips endobj, and anything else that isn't "<number> <generation> obj"
+                    m = RE_PDF_OBJ_NUMBER.search(buffer, max(0, obj_at - PDF_OVERLAP), obj_at)
+                    if m is None:
+                        continue
+                    self.pdf_section = int(m.group(1))
+
+            end = self.find_pdf_section_end(buffer, pos)
+            if end < 0:
+                if len(buffer) - pos < PDF_HEAD_LIMIT:
+                    break
+                end = pos + PDF_HEAD_LIMIT
+            self.read_pdf_section(self.pdf_section, buffer[pos:end])
+            self.pdf_section = None
+            pos = end
+        self.pdf_buffer = buffer[pos:]
+
+    @staticmethod
+    def find_pdf_section_end(buffer, start):
+        end = start + PDF_HEAD_LIMIT
+        found = -1
+        for word in PDF_SECTION_END_WORDS:
+            i = buffer.find(word, start, end)
+            if i >= 0:
+                # only the nearest counts, so don't look any further than it
+                end = found = i
+        return found
+
+    def read_pdf_section(self, number, head):
+        # trailers and cross-reference streams both carry the /Root
+        m = RE_PDF_ROOT.search(head)
+        if m:
+            self.pdf_root = int(m.group(1))
+        m = RE_PDF_TYPE.search(head) if number else None
+        if m is None:
+            return
+        if m.group(1) == b'Catalog':
+            ref = RE_PDF_PAGES_REF.search(head)
+            self.pdf_catalogs[number] = int(ref.group(1)) if ref else None
+        else:
+            count = RE_PDF_COUNT.search(head)
+            self.pdf_page_trees[number] = int(count.group(1)) if count else None
+
+    @property
+    def page_count(self):
+        pages = self.pdf_catalogs.get(self.pdf_root)
+        return self.pdf_page_trees.get(pages) or None
+
+    def sniffed(self):
+        if self.pdf_section is not None:
+            # whatever was left at the end of the file
+            self.read_pdf_section(self.pdf_section, self.pdf_buffer[:PDF_HEAD_LIMIT])
+            self.pdf_section = None
+        found = {
+            'sha256': self.digest.hexdigest(),
+            'content_kind': self.kind,
+        }
+        if self.image_size is not None:
+            found['image_size'] = self.image_size
+        if self.page_count is not None:
+            found['page_count'] = self.page_count
+        return found
+
+
+class SniffingMixin(object):
+    def new_file(self, *args, **kwargs):
+        # NOTE: before the handler gets to raise StopFutureHandlers
+        self.sniffer = UploadSniffer()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed = super().receive_data_chunk(raw_data, start)
+        # only the handler actually keeping the bytes looks at them
+        if passed is None:
+            self.sniffer.feed(raw_data, start)
+        return passed
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            for name, value in self.sniffer.sniffed().items():
+                setattr(file, name, value)
+        return file
+
+
+class MediaTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    # on the same filesystem as the media, so storing an upload is a rename
+    def new_file(self, *args, **kwargs):
+        # NOTE: skips TemporaryFileUploadHandler's, which makes a file of its own
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = MediaTemporaryFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+
+class SniffingMemoryFileUploadHandler(SniffingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class SniffingTemporaryFileUploadHandler(SniffingMixin, MediaTemporaryFileUploadHandler):
+    pass
+
+
+def use_sniffing_handlers(request):
+    """
+    Swaps in the sniffing upload handlers; has to happen before anything has
+    looked at request.POST or request.FILES.
+    """
+    request.upload_handlers = [
+        SniffingMemoryFileUploadHandler(request),
+        SniffingTemporaryFileUploadHandler(request),
+    ]
@@ -7,6 +7,7 @@ app_name = 'comics'
 installment_patterns = [
     path('p<int:page>', views.installment_page, name='page'),
     path('next', views.installment_page),
+    path('manifest', views.installment_manifest, name='manifest'),
     path('', views.installment_detail, name='installment'),
 ]
 
@@ -23,6 +24,8 @@ strip_patterns = [
 
 urlpatterns = [
     path('comics/', views.index, name='index'),
+    path('comics/cache-stats', views.cache_stats, name='cache_stats'),
+    path('search', views.search, name='search'),
     path('installment/<suuid:installment>/p<int:page>', views.page_redirect, name='page'),
     path('installment/<suuid:installment>', views.installment_redirect, name='installment'),
     path('series/<suuid:series>/', include(series_patterns)),
@@ -1,3 +1,4 @@
+import hashlib
 import math
 import re
 from decimal import Decimal, InvalidOperation
@@ -58,6 +59,10 @@ def get_sort_dir(name):
 def get_upload_fp(data):
     if hasattr(data, 'temporary_file_path'):
         return data.temporary_file_path()
+    elif isinstance(getattr(data, 'file', None), BytesIO):
+        # an in-memory upload can be read from its own buffer, rather than a copy
+        data.file.seek(0)
+        return data.file
     else:
         if hasattr(data, 'read'):
             return BytesIO(data.read())
@@ -65,6 +70,15 @@ def get_upload_fp(data):
             return BytesIO(data['content'])
 
 
+def file_sha256(file):
+    digest = hashlib.sha256()
+    # chunks() starts from the top, and leaves the file at the end
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
 # Would prefer awesome-slugify, but it relies on unidecode (GPL) and hasn't been
 # updated in a while. Maybe just roll a combination of the two at some point...
 slugify_filename = partial(slugify, max_length=250, separator='_', lowercase=False)
@@ -17,6 +17,11 @@ ARCHIVE_EXTS = {
     'zip',
 }
 
+CBZ_EXTS = {
+    'cbz',
+    'zip',
+}
+
 HANDLED_EXTS = IMAGE_EXTS | ARCHIVE_EXTS
 
 
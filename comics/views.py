@@ -1,18 +1,31 @@
+import json
+from collections import Counter
 from itertools import groupby
 from operator import attrgetter
+from pathlib import PurePosixPath
 
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator
 from django.db.models import Count, Case, When, OuterRef, Exists, F, Q
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.utils.cache import patch_cache_control
 from django.utils.translation import ugettext as _
 from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.renderers import TemplateHTMLRenderer, JSONRenderer
 from rest_framework.response import Response
 
+from comics.conditional import conditional_view, latest_stamp, get_response_stats
+from comics.search import search_entries
+from comics.storage import BLOB_DIR, is_blob_name
 from comics.serializers import PageSerializer, InstallmentSerializer, SeriesSerializer, StripInstallmentSerializer
 from metadata.models import Persona, Character, Credit, Creator
 from .models import Installment, Page, Thread, Series
 
+THREAD_PAGE_SIZE = 100
+
 
 # See also: http://stackoverflow.com/questions/480214/
 def gen_credit_list(credit_list):
@@ -69,12 +82,55 @@ def gen_page_links(page):
     return data
 
 
+def gen_page_manifest(installment):
+    # column-oriented, and every page whose URL is just prefix + number + ext
+    # is left implicit; see gen_src_loc for how those names come about. Shared
+    # blobs are given by their hash instead, see blob_name, so those are too
+    storage = Page._meta.get_field('file').storage
+    rows = Page.objects \
+        .filter(installment=installment) \
+        .order_by('order') \
+        .values_list('file', 'file_width', 'file_height')
+
+    names = [name for name, _, _ in rows]
+    hashes = [PurePosixPath(name).stem if is_blob_name(name) else None for name in names]
+    manifest = {
+        'prefix': '',
+        'ext': '',
+        'width': [w for _, w, _ in rows],
+        'height': [h for _, _, h in rows],
+        'files': {},
+    }
+    if names:
+        own = [name for name, sha256 in zip(names, hashes) if sha256 is None]
+        if own:
+            manifest['prefix'] = storage.url('{}/'.format(PurePosixPath(own[0]).parent))
+        manifest['ext'] = Counter(PurePosixPath(n).suffix for n in names).most_common(1)[0][0]
+    if any(hashes):
+        manifest['blob_prefix'] = storage.url('{}/'.format(BLOB_DIR))
+        manifest['hashes'] = hashes
+
+    for i, (name, sha256) in enumerate(zip(names, hashes)):
+        url = storage.url(name)
+        if sha256 is None:
+            implicit = '{}{:04d}{}'.format(manifest['prefix'], i, manifest['ext'])
+        else:
+            implicit = '{}{}/{}/{}{}'.format(manifest['blob_prefix'], sha256[:2], sha256[2:4], sha256, manifest['ext'])
+        if url != implicit:
+            manifest['files'][i] = url
+
+    return manifest
+
+
 def gen_thread_links(instance):
     if isinstance(instance, Installment):
-        next_id = instance.next_id
+        next_kwargs = instance.next_url_kwargs
+        if next_kwargs:
+            next_kwargs['page'] = 0
         return {
             'thread': reverse('comics:installment', args=[instance.id]),
-            'next': reverse('comics:page', args=[next_id, 0]) if next_id else '',
+            'manifest': reverse('comics:manifest', kwargs=instance.get_url_kwargs()),
+            'next': reverse('comics:page', kwargs=next_kwargs) if next_kwargs else '',
             'parent': reverse('comics:series', args=[instance.series_id]),
         }
     elif isinstance(instance, Series):
@@ -84,24 +140,88 @@ def gen_thread_links(instance):
             }
 
 
+def series_q(series, prefix=''):
+    return Q(**{prefix + 'pk': series}) | Q(**{prefix + 'slug': series})
+
+
 def get_series_or_404(series, *args, **kwargs):
-    return get_object_or_404(Series.display_objects,
-                             Q(pk=series) | Q(slug=series),
+    return get_object_or_404(Series,
+                             series_q(series),
                              *args, **kwargs)
 
 
-def get_inst_or_404(series, number=None, ordinal=None, **_):
-    if 'number' is not None:
-        return get_object_or_404(Installment, series=series, number=number)
+def get_inst_or_404(series, number=None, ordinal=None, queryset=Installment.objects, **_):
+    if number is not None:
+        return get_object_or_404(queryset, series=series, number=number)
+    else:
+        return get_object_or_404(queryset, series=series, ordinal=ordinal)
+
+
+#########################################
+# Validators                            #
+#########################################
+
+def index_stamps():
+    return [
+        latest_stamp(Series.objects.all()),
+        latest_stamp(Thread.objects.all()),
+    ]
+
+
+def series_stamps(series, **_):
+    return [
+        latest_stamp(Series.objects.filter(series_q(series))),
+        latest_stamp(Creator.objects.filter(series_q(series, 'credits__installment__series__'))),
+    ]
+
+
+def installment_stamps(series, number=None, ordinal=None, **_):
+    # Series are bumped by every Installment, which also covers the neighbours
+    installments = Installment.objects.filter(series_q(series, 'series__'))
+    if number is not None:
+        installments = installments.filter(number=number)
     else:
-        return get_object_or_404(Installment, series=series, ordinal=ordinal)
+        installments = installments.filter(ordinal=ordinal)
+    return series_stamps(series) + [
+        latest_stamp(installments),
+        latest_stamp(Persona.objects.filter(appearances__installment__in=installments)),
+    ]
+
+
+def manifest_stamps(series, number=None, ordinal=None, **_):
+    # just the pages' own rows; the installment's is there for when it has none
+    installments = Installment.objects.filter(series_q(series, 'series__'))
+    if number is not None:
+        installments = installments.filter(number=number)
+    else:
+        installments = installments.filter(ordinal=ordinal)
+    return [
+        latest_stamp(installments),
+        latest_stamp(Page.objects.filter(installment__in=installments)),
+    ]
+
 
+def thread_stamps(thread):
+    return [
+        latest_stamp(Thread.objects.filter(pk=thread)),
+        latest_stamp(Installment.objects.filter(threadsequence__thread=thread)),
+    ]
 
+
+#########################################
+# Views                                 #
+#########################################
+
+
+@conditional_view(index_stamps)
 @api_view(['GET'])
 def index(request):
     threads = Thread.objects.all()
     strips = Series.objects.filter(is_strip=True)
-    installments = Installment.objects.filter(series__is_strip=False)
+    installments = Installment.objects \
+        .filter(series__is_strip=False) \
+        .select_related('series__installment_label') \
+        .with_cover()
     context = {
         'threads': threads,
         'strips': strips,
@@ -115,13 +235,15 @@ def installment_redirect(request, installment):
     return redirect(installment.get_absolute_url())
 
 
+@conditional_view(installment_stamps, cache=True)
 @api_view(['GET'])
 @renderer_classes([TemplateHTMLRenderer, JSONRenderer])
 def installment_detail(request, series, **kwargs):
     series = get_series_or_404(series)
-    installment = get_inst_or_404(series, **kwargs)
 
     if request.accepted_renderer.format == 'json':
+        queryset = InstallmentSerializer.setup_eager_loading(Installment.objects)
+        installment = get_inst_or_404(series, queryset=queryset, **kwargs)
         serializer = InstallmentSerializer(instance=installment)
         context = {
             'thread': serializer.data,
@@ -129,6 +251,7 @@ def installment_detail(request, series, **kwargs):
         }
         return Response(context)
 
+    installment = get_inst_or_404(series, **kwargs)
     credit_list = installment.credits \
         .select_related('role', 'creator') \
         .all()
@@ -154,15 +277,17 @@ def installment_detail(request, series, **kwargs):
         star.app_total = sum([pa.app_count for pa in pl])
         return star
 
-    appearances = sorted([get_char(g) for _, g in groupby(personas, lambda m: m.character)],
-                         key=attrgetter('app_total'), reverse=True)
+    def get_appearances():
+        return sorted([get_char(g) for _, g in groupby(personas, lambda m: m.character)],
+                      key=attrgetter('app_total'), reverse=True)
 
+    # NOTE: lazy, so that nothing is queried when the template has them cached
     context = {
         'series': series,
         'installment': installment,
-        'credits': gen_credit_list(credit_list),
+        'credits': SimpleLazyObject(lambda: gen_credit_list(credit_list)),
         'pages': installment.pages.all(),
-        'appearances': appearances,
+        'appearances': SimpleLazyObject(get_appearances),
     }
     return Response(context, template_name='comics/installment.html')
 
@@ -173,6 +298,20 @@ def page_redirect(request, installment, page):
     return redirect(page.get_absolute_url())
 
 
+@conditional_view(manifest_stamps, strong=True)
+@api_view(['GET'])
+def installment_manifest(request, series, **kwargs):
+    series = get_series_or_404(series)
+    installment = get_inst_or_404(series, **kwargs)
+
+    body = json.dumps(gen_page_manifest(installment), separators=(',', ':'))
+    response = HttpResponse(body, content_type='application/json')
+    # always revalidated, which the stamps make cheap
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@conditional_view(installment_stamps)
 @api_view(['GET'])
 @renderer_classes([TemplateHTMLRenderer, JSONRenderer])
 def installment_page(request, series, **kwargs):
@@ -200,6 +339,7 @@ def installment_page(request, series, **kwargs):
     return Response({'initial_state': initial_state}, template_name='comics/page.html')
 
 
+@conditional_view(series_stamps, cache=True)
 @api_view(['GET'])
 @renderer_classes([TemplateHTMLRenderer, JSONRenderer])
 def series_detail(request, series):
@@ -225,19 +365,23 @@ def series_detail(request, series):
                 'creator__working_name',
                 'creator__avatar')
 
+    # NOTE: no iterator(), as that would skip the cover prefetch
     installments = series.installments \
         .order_by('-ordinal') \
-        .iterator()
+        .with_cover()
 
+    # NOTE: lazy, so that nothing is queried when the template has them cached
     context = {
         'series': series,
-        'credits': gen_credit_list(credit_list),
+        'credits': SimpleLazyObject(lambda: gen_credit_list(credit_list)),
+        'credited': Creator.objects.filter(credits__installment__series=series),
         'num_installments': series.installment_count,
         'installments': installments,
     }
     return render(request, 'comics/series.html', context)
 
 
+@conditional_view(series_stamps)
 @api_view(['GET'])
 @renderer_classes([TemplateHTMLRenderer, JSONRenderer])
 def strip_page(request, series, page):
@@ -257,18 +401,38 @@ def strip_page(request, series, page):
         },
         'thread': {
             'name': series.name,
-            'num_pages': series.installments.count(),
+            'num_pages': series.installment_count,
         }
     }
 
     return Response({'initial_state': initial_state}, template_name='comics/page.html')
 
 
+@conditional_view(thread_stamps)
 @api_view(['GET'])
 def thread_detail(request, thread):
     thread = get_object_or_404(Thread, pk=thread)
+    pages = Paginator(thread.pages, THREAD_PAGE_SIZE).get_page(request.GET.get('page'))
     context = {
         'thread': thread,
-        'pages': thread.pages,
+        'pages': pages,
     }
     return render(request, 'comics/thread.html', context)
+
+
+@api_view(['GET'])
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'results': search_entries(query) if query else [],
+    }
+    return render(request, 'comics/search.html', context)
+
+
+@staff_member_required
+def cache_stats(request):
+    # NOTE: counters live in the cache itself, so with locmem they're per process
+    stats = {name: {'hits': hits, 'misses': misses}
+             for name, hits, misses in get_response_stats()}
+    return JsonResponse(stats)
@@ -1,20 +1,30 @@
+import os
+
+from django.conf import settings
 from django.template.defaultfilters import json_script, date, time
 from django.templatetags.static import static
 from django.urls import reverse
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache
 from webpack_loader.templatetags.webpack_loader import render_bundle
 
+from comics.templatetags.cache_extras import FragmentCacheExtension
 from comics.templatetags.comics_extras import page_num, oxford_comma, ugroupby, inflect
-from comics.templatetags.image_extras import thumbgen, thumburl
+from comics.templatetags.image_extras import thumbgen, thumburl, coverurl, coversrcset
 from metadata.templatetags.metadata_extras import role_summary
 
 
 def environment(**options):
+    options['extensions'] = list(options.get('extensions', [])) + [FragmentCacheExtension]
+    if settings.JINJA2_BYTECODE_CACHE_DIR and 'bytecode_cache' not in options:
+        os.makedirs(settings.JINJA2_BYTECODE_CACHE_DIR, exist_ok=True)
+        options['bytecode_cache'] = FileSystemBytecodeCache(settings.JINJA2_BYTECODE_CACHE_DIR)
     env = Environment(**options)
     env.globals.update({
         'static': static,
         'url': reverse,
 
+        'coversrcset': coversrcset,
+        'coverurl': coverurl,
         'render_bundle': render_bundle,
         'thumbgen': thumbgen,
         'thumburl': thumburl,
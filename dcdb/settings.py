@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -107,6 +108,52 @@ DATABASES = {
     }
 }
 
+# NOTE: needs psycopg2; the test suite runs against either, e.g.
+#       DJANGO_DB_ENGINE=postgresql DJANGO_DB_NAME=dcdb ./manage.py test
+if os.environ.get('DJANGO_DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DJANGO_DB_NAME', 'dcdb'),
+        'USER': os.environ.get('DJANGO_DB_USER', ''),
+        'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+        'HOST': os.environ.get('DJANGO_DB_HOST', ''),
+        'PORT': os.environ.get('DJANGO_DB_PORT', ''),
+    }
+
+# run on every new SQLite connection, in order; see settings_production
+SQLITE_PRAGMAS = {}
+
+
+# Caching
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared between worker processes, unlike locmem
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': os.path.join(BASE_DIR, '_cache'),
+    # },
+}
+
+# rendered pages are keyed by their validators, so stale entries are never
+# served; the timeout only bounds how long they take up space
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# same again for {% cache %} fragments within templates
+FRAGMENT_CACHE_ALIAS = 'default'
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# compiled templates, shared by all workers; fill with ./manage.py compile_templates,
+# or set DJANGO_JINJA2_CACHE_DIR empty to do without
+JINJA2_BYTECODE_CACHE_DIR = os.environ.get('DJANGO_JINJA2_CACHE_DIR', os.path.join(BASE_DIR, '_jinja2')) or None
+# NOTE: not under test, where it would be left behind in the checkout
+if 'test' in sys.argv[1:2]:
+    JINJA2_BYTECODE_CACHE_DIR = None
+
 
 # Logging
 # http://stackoverflow.com/questions/4375784/log-all-sql-queries
@@ -178,6 +225,21 @@ STATIC_URL = '/static/'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, '_media')
+# uploads and other temporary files; on the same filesystem as MEDIA_ROOT, so
+# storing one is a rename, but outside it, so they're never served. Clear out
+# what crashed workers leave behind with ./manage.py clean_media_temp
+MEDIA_TEMP_DIR = os.path.join(BASE_DIR, '_media_tmp')
+
+DEFAULT_FILE_STORAGE = 'comics.storage.MediaStorage'
+
+# store Page files once per distinct content, under blobs/, rather than per Installment
+CONTENT_ADDRESSED_PAGES = False
+
+
+# Importing
+
+# worker processes used to rasterize PDF pages; None means one less than the CPU count
+PDF_RASTER_WORKERS = None
 
 
 # Rest Framework
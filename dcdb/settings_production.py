@@ -0,0 +1,77 @@
+"""
+Production settings for ComicDB.
+
+Everything not overridden here comes from the development settings. Use with
+
+    DJANGO_SETTINGS_MODULE=dcdb.settings_production
+    DJANGO_SECRET_KEY=...
+    DJANGO_ALLOWED_HOSTS=comics.example.com,...
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from dcdb.settings import *  # noqa: F401,F403
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+DEBUG = False
+
+# NOTE: no default, a deploy that forgets them shouldn't answer for any host
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host.strip()]
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured('Set DJANGO_ALLOWED_HOSTS to a comma-separated list of host names.')
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'debug_toolbar']
+
+MIDDLEWARE = [m for m in MIDDLEWARE if not m.startswith('debug_toolbar.')]
+
+# templates only change on deploy, which restarts the workers anyway
+TEMPLATES[0]['OPTIONS']['auto_reload'] = False
+
+
+# Database
+
+# reuse connections across requests, and with them the pragmas and page cache
+DATABASES['default']['CONN_MAX_AGE'] = 600
+
+# NOTE: each worker holds on to one connection per thread, so with PostgreSQL
+#       point DJANGO_DB_HOST/PORT at a PgBouncer in transaction pooling mode
+#       to share a few server connections between all of them, and set
+#       DJANGO_DB_POOLED=1. Server-side cursors (used by .iterator()) don't
+#       survive from one transaction to the next there, so those are off.
+if os.environ.get('DJANGO_DB_POOLED'):
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# NOTE: WAL lets readers carry on while an import is writing, and makes
+#       synchronous=NORMAL safe (only the last commits can be lost on power
+#       failure, never the database); busy_timeout has writers queue up
+#       rather than fail straight away
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # negative means KiB rather than pages, so 64 MiB
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+
+# Caching
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', os.path.join(BASE_DIR, '_cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
+# Webpack
+
+WEBPACK_LOADER['DEFAULT']['CACHE'] = True
@@ -6,12 +6,12 @@ from django.contrib import admin
 from django.contrib.admin import TabularInline
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.db.models import F, When, Case, Value
 from django.forms import widgets
 from django.forms.formsets import DELETION_FIELD_NAME
 
-from comics.admin import InstallmentAdmin
+from comics.admin import InstallmentAdmin, IndexedSearchMixin
 from comics.forms import CroppieField, CroppieInput
 from comics.models import Installment
 from comics.util import is_model_request
@@ -66,7 +66,7 @@ class CreatorForm(forms.ModelForm):
 
 
 @admin.register(Creator)
-class CreatorAdmin(admin.ModelAdmin):
+class CreatorAdmin(IndexedSearchMixin, admin.ModelAdmin):
     search_fields = ('working_name',)
     inlines = [CreatorUrlInline]
     form = CreatorForm
@@ -235,7 +235,7 @@ class CharacterForm(forms.ModelForm):
 
 
 @admin.register(Character)
-class CharacterAdmin(admin.ModelAdmin):
+class CharacterAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('name', aka, creators)
     search_fields = (
         'personas__name',
@@ -383,32 +383,40 @@ class AppearanceInlineForm(forms.ModelForm):
 class AppearanceInlineFormset(forms.BaseInlineFormSet):
     # NOTE: If using SQLite, ROW_NUMBER() requires sqlite3.sqlite_version >= 3.25.0
     # NOTE: Django supports Window functions, but I gave up trying to make an equivalent query happen.
+    # NOTE: Only aggregates leave the GROUP BY, so the range's first Appearance is joined back
+    #       in for the rest; this way it runs on PostgreSQL as well as SQLite.
     # https://stackoverflow.com/a/17046749
     def get_queryset(self):
         if not hasattr(self, '_queryset'):
+            order = connection.ops.quote_name('order')
             self._queryset = Appearance.objects \
                 .raw('''
                 WITH    T   /* want page sequence islands, within types, for each persona */
-                        AS (SELECT  persona_id || type || (
-                                        ROW_NUMBER()
-                                        OVER (PARTITION BY persona_id, type 
-                                              ORDER     BY "order") - "order"
-                                    ) AS grp,
-                                    "order" AS ordinal,
+                        AS (SELECT  ma0.persona_id,
+                                    ma0.type,
+                                    ROW_NUMBER()
+                                    OVER (PARTITION BY ma0.persona_id, ma0.type
+                                          ORDER     BY cp0.{order}) - cp0.{order} AS grp,
+                                    cp0.{order} AS ordinal,
                                     ma0.id AS appearance_id
-                            FROM    comics_page INNER JOIN  metadata_appearance ma0
-                                                ON          sourceimage_ptr_id = page_id
-                            WHERE   ma0.installment_id = %s)
+                            FROM    comics_page cp0 INNER JOIN  metadata_appearance ma0
+                                                    ON          cp0.sourceimage_ptr_id = ma0.page_id
+                            WHERE   ma0.installment_id = %s),
+                        G
+                        AS (SELECT  MIN(appearance_id) AS appearance_id,
+                                    MIN(ordinal) AS begin_ord,
+                                    MAX(ordinal) AS end_ord
+                            FROM    T
+                            GROUP   BY persona_id, type, grp)
                 SELECT 	ma1.*,
-                        MIN(ordinal) AS begin_ord,
-                        MAX(ordinal) AS end_ord
-                FROM   	T   INNER JOIN  metadata_appearance ma1
-                            ON          T.appearance_id = ma1.id
+                        G.begin_ord,
+                        G.end_ord
+                FROM   	G   INNER JOIN  metadata_appearance ma1
+                            ON          G.appearance_id = ma1.id
                             INNER JOIN  metadata_persona mp0
                             ON          ma1.persona_id = mp0.id
-                GROUP  	BY grp
-                ORDER  	BY MIN(ordinal), mp0.name
-                ''', [self.instance.pk])
+                ORDER  	BY G.begin_ord, mp0.name
+                '''.format(order=order), [self.instance.pk])
         return self._queryset
 
     def full_clean(self):
@@ -3,12 +3,14 @@ from urllib.parse import urlparse
 
 from django.db import models
 from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.functional import cached_property
 from django.utils.text import capfirst
-from tldextract import extract as urlextract
 
 from comics.fields import ShortUUIDMixin
+from comics.models import Installment, Series, touch
 from comics.util import slugify_name
 
 #########################################
@@ -82,6 +84,9 @@ class Creator(ShortUUIDMixin, models.Model):
         through='metadata.Credit',
         related_name='creators',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
 
     @property
     def slug(self):
@@ -127,6 +132,9 @@ class CreatorUrl(models.Model):
 
     @cached_property
     def icon_name(self):
+        # NOTE: slow to import, and only ever needed on the creator pages
+        from tldextract import extract as urlextract
+
         domain = urlextract(self.link).domain.lower()
         return DOMAIN_ICON_MAP.get(domain)
 
@@ -221,6 +229,9 @@ class Character(ShortUUIDMixin, models.Model):
         blank=True,
         help_text='One-to-several paragraphs, but not a full wiki entry.',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
 
     @property
     def name(self):
@@ -328,6 +339,9 @@ class Persona(ShortUUIDMixin, models.Model):
         through='metadata.Appearance',
         related_name='personas',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
 
     @property
     def is_primary(self):
@@ -416,3 +430,58 @@ class Appearance(models.Model):
         # NOTE: begin/end_ord are the currently informal definition of a range
         ordinal = self.begin_ord if hasattr(self, 'begin_ord') else self.page.order
         return '{} in {} at [{}]'.format(self.persona, self.installment, ordinal)
+
+
+#########################################
+# Signals                               #
+#########################################
+
+def touch_installment(installment_id):
+    touch(Installment.objects.filter(pk=installment_id))
+    touch(Series.objects.filter(installments=installment_id))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Credit)
+@receiver(post_delete, sender=Credit)
+def credit_changed_handler(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    touch_installment(instance.installment_id)
+    touch(Creator.objects.filter(pk=instance.creator_id))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Persona)
+@receiver(post_delete, sender=Persona)
+def persona_changed_handler(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch(Character.objects.filter(pk=instance.character_id))
+
+
+# noinspection PyUnusedLocal
+@receiver(m2m_changed, sender=Persona.creators.through)
+def persona_creators_changed_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    # NOTE: pk_set is None when clearing, so look up the other side beforehand
+    if reverse:
+        creators = Creator.objects.filter(pk=instance.pk)
+        personas = Persona.objects.filter(pk__in=pk_set) if pk_set else instance.personas.all()
+    else:
+        creators = Creator.objects.filter(pk__in=pk_set) if pk_set else instance.creators.all()
+        personas = Persona.objects.filter(pk=instance.pk)
+    touch(Character.objects.filter(personas__in=personas))
+    touch(Persona.objects.filter(pk__in=personas))
+    touch(Creator.objects.filter(pk__in=creators))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Appearance)
+@receiver(post_delete, sender=Appearance)
+def appearance_changed_handler(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    touch_installment(instance.installment_id)
+    touch(Character.objects.filter(personas=instance.persona_id))
@@ -1,3 +1,103 @@
-from django.test import TestCase
+from django.forms import inlineformset_factory
 
-# Create your tests here.
+from comics.models import Series, Installment
+from comics.tests import MediaTestCase, QueryCountTestCase, make_installment
+from metadata.admin import AppearanceInlineForm, AppearanceInlineFormset
+from metadata.models import Character, Persona, Appearance, Creator, Credit, Role
+
+
+def make_character(name):
+    character = Character.objects.create()
+    persona = Persona.objects.create(character=character, name=name)
+    character.primary_persona = persona
+    character.save()
+    return character, persona
+
+
+class ListingQueryTests(QueryCountTestCase):
+    def setUp(self):
+        self.character, self.persona = make_character('Hero')
+        self.creator = Creator.objects.create(working_name='Someone')
+        self.role = Role.objects.first()
+        self.add_series('Alpha')
+
+    def add_series(self, name):
+        series = Series.objects.create(name=name, slug=name.lower())
+        installment = make_installment(series, 1)
+        Appearance.objects.create(persona=self.persona,
+                                  installment=installment,
+                                  page=installment.pages.first())
+        Credit.objects.create(installment=installment, creator=self.creator, role=self.role)
+
+    def add_more_series(self):
+        for name in ('Beta', 'Gamma', 'Delta'):
+            self.add_series(name)
+
+    def test_character_page(self):
+        self.assertQueriesDoNotGrow(self.character.get_absolute_url(), self.add_more_series)
+
+    def test_creator_page(self):
+        self.assertQueriesDoNotGrow(self.creator.get_absolute_url(), self.add_more_series)
+
+
+class ConditionalGetTests(QueryCountTestCase):
+    def setUp(self):
+        self.character, self.persona = make_character('Hero')
+        self.creator = Creator.objects.create(working_name='Someone')
+
+    def assertChanges(self, url, change):
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_persona_bumps_character(self):
+        self.assertChanges(self.character.get_absolute_url(),
+                           lambda: Persona.objects.create(character=self.character, name='Alias'))
+
+    def test_credit_bumps_creator(self):
+        def credit():
+            series = Series.objects.create(name='Alpha', slug='alpha')
+            Credit.objects.create(installment=make_installment(series, 1),
+                                  creator=self.creator,
+                                  role=Role.objects.first())
+        self.assertChanges(self.creator.get_absolute_url(), credit)
+
+    def test_persona_creators_bump_creator(self):
+        self.assertChanges(self.creator.get_absolute_url(),
+                           lambda: self.persona.creators.add(self.creator))
+
+
+class PortableQueryTests(MediaTestCase):
+    def setUp(self):
+        self.character, self.persona = make_character('Hero')
+
+    def appear(self, installment, orders, persona=None):
+        for page in installment.pages.filter(order__in=orders):
+            Appearance.objects.create(persona=persona or self.persona, installment=installment, page=page)
+
+    def test_first_issues(self):
+        beta = Series.objects.create(name='Beta', slug='beta')
+        make_installment(beta, 1)
+        self.appear(make_installment(beta, 2), [0])
+        alpha = Series.objects.create(name='Alpha', slug='alpha')
+        self.appear(make_installment(alpha, 1), [0])
+        make_installment(Series.objects.create(name='Gamma', slug='gamma'), 1)
+
+        content = self.client.get(self.character.get_absolute_url()).content.decode()
+        self.assertEqual(content.count('Cover for'), 2)
+        self.assertLess(content.index('Cover for Alpha'), content.index('Cover for Beta'))
+
+    def test_appearance_ranges(self):
+        installment = make_installment(Series.objects.create(name='Alpha', slug='alpha'), 1, num_pages=5)
+        _, villain = make_character('Villain')
+        self.appear(installment, [0, 1, 2, 4])
+        self.appear(installment, [1], villain)
+
+        formset_class = inlineformset_factory(Installment, Appearance,
+                                              form=AppearanceInlineForm,
+                                              formset=AppearanceInlineFormset,
+                                              extra=0)
+        ranges = [(a.persona.name, a.begin_ord, a.end_ord)
+                  for a in formset_class(instance=installment).get_queryset()]
+        self.assertEqual(ranges, [('Hero', 0, 2), ('Villain', 1, 1), ('Hero', 4, 4)])
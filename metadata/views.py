@@ -1,13 +1,53 @@
-from django.db.models import F, Exists, OuterRef, Q, Count
-from django.db.models.query import Prefetch
+from django.db.models import F, Exists, OuterRef, Q, Count, Subquery
 from django.shortcuts import render, get_object_or_404, redirect
 from rest_framework.decorators import api_view
 
+from comics.conditional import conditional_view, latest_stamp
 from comics.expressions import GroupConcat
-from comics.models import Installment, Page, Series
+from comics.models import Installment, Series, cover_prefetch
 from metadata.models import Character, Creator, Persona
 
 
+#########################################
+# Validators                            #
+#########################################
+
+def character_index_stamps():
+    return [
+        latest_stamp(Character.objects.all()),
+        latest_stamp(Persona.objects.all()),
+    ]
+
+
+def character_stamps(character, **_):
+    # Characters are bumped by their Personas and Appearances
+    return [
+        latest_stamp(Character.objects.filter(pk=character)),
+        latest_stamp(Series.objects.filter(installments__appearances__persona__character=character)),
+    ]
+
+
+def creator_index_stamps():
+    return [
+        latest_stamp(Creator.objects.all()),
+    ]
+
+
+def creator_stamps(creator, **_):
+    # Creators are bumped by their Credits and Personas
+    return [
+        latest_stamp(Creator.objects.filter(pk=creator)),
+        latest_stamp(Persona.objects.filter(creators=creator)),
+        latest_stamp(Character.objects.filter(personas__creators=creator)),
+        latest_stamp(Series.objects.filter(installments__credits__creator=creator)),
+    ]
+
+
+#########################################
+# Views                                 #
+#########################################
+
+@conditional_view(character_index_stamps)
 @api_view(['GET'])
 def character_index(request):
     characters = Character.objects \
@@ -22,6 +62,7 @@ def character_index(request):
     return render(request, 'metadata/characters.html', context)
 
 
+@conditional_view(character_stamps, cache=True)
 @api_view(['GET'])
 def character_page(request, character, slug_name=None):
     character = get_object_or_404(Character.objects, pk=character)
@@ -29,43 +70,29 @@ def character_page(request, character, slug_name=None):
     if slug_name != character.slug:
         return redirect(character.get_absolute_url())
 
-    first_pages = Page.objects.filter(order=0)
+    appears_in = Series.objects.filter(installments__appearances__persona__character=character)
+    first = Installment.objects \
+        .filter(series=OuterRef('series')) \
+        .order_by('ordinal', 'number') \
+        .values('pk')[:1]
     first_issues = Installment.objects \
-        .prefetch_related(Prefetch('pages', queryset=first_pages)) \
-        .raw('''
-        WITH    T
-                AS (SELECT  ROW_NUMBER() OVER 
-                                        (PARTITION BY series_id 
-                                         ORDER     BY number) AS ordinal,
-                            *
-                    FROM    comics_installment)
-        SELECT 	T.id AS id,
-                series_id,
-                has_cover,
-                "comics_series"."name" AS series_name
-        FROM   	            T   
-                INNER JOIN  comics_series
-                ON          comics_series.id = T.series_id
-        WHERE   T.ordinal = 1 AND (
-                T.series_id	IN (SELECT  ci0.series_id
-                                FROM                comics_installment ci0
-                                        INNER JOIN  metadata_appearance ma1 
-                                        ON          ma1.installment_id = ci0.id
-                                        INNER JOIN  metadata_persona mp0 
-                                        ON          mp0.id = ma1.persona_id
-                                WHERE   mp0.character_id = %s))
-        ORDER  	BY "comics_series"."name"
-        ''', [character.pk])
+        .filter(pk=Subquery(first), series__in=appears_in) \
+        .annotate(series_name=F('series__name')) \
+        .select_related('series') \
+        .prefetch_related(cover_prefetch()) \
+        .order_by('series__name')
 
     context = {
         'character': character,
         'persona': character.primary_persona,
         'aka': ', '.join(character.aka.values_list('name', flat=True)),
         'first_issues': first_issues,
+        'appears_in': appears_in,
     }
     return render(request, 'metadata/character.html', context)
 
 
+@conditional_view(creator_index_stamps)
 @api_view(['GET'])
 def creator_index(request):
     # NOTE: gotta do a Subquery to easily sort by Role.order
@@ -79,6 +106,7 @@ def creator_index(request):
     return render(request, 'metadata/creators.html', context)
 
 
+@conditional_view(creator_stamps, cache=True)
 @api_view(['GET'])
 def creator_page(request, creator, slug_name=None):
     creator = get_object_or_404(Creator, pk=creator)
@@ -97,12 +125,13 @@ def creator_page(request, creator, slug_name=None):
         .iterator()
 
     # return one row per role and perform a groupby in the template rendering
-    series = Series.display_objects \
+    series = Series.objects \
         .filter(installments__creators__pk=creator.pk) \
         .annotate(role_name=F('installments__credits__role__name'),
                   role_count=Count(F('installments__credits__role__name'))) \
         .order_by('name', 'pk', 'installments__credits__role__order') \
-        .only('name')
+        .only('name', 'slug', 'is_strip', 'installment_count') \
+        .with_cover()
 
     # TODO: show cover of first installment with a credit on?
 